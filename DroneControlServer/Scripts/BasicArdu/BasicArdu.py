@@ -4,8 +4,9 @@
 Basic Dronekit Wrapper for ArduPilot controller
 '''
 from argparse import ArgumentParser
-from time import sleep, time
-from math import pi
+from collections import OrderedDict
+from threading import Condition, Event, Lock
+from time import sleep
 
 # Necessary For Package imports
 import sys
@@ -17,12 +18,23 @@ sys.path.append(os.path.normpath(os.path.join(SCRIPT_DIR, PACKAGE_PARENT)))
 #from BasicArducopter.tools.MavLowLevel import *
 #from BasicArducopter.tools.CommonStructs import Frames, Waypoint, xyz_to_latlon
 from tools.MavLowLevel import *
-from tools.CommonStructs import Frames, Waypoint, xyz_to_latlon
+from tools.Clock import RealClock
+from tools.CommonStructs import Frames, Geodesy, JobStatus, TangentPlane, Waypoint, WaypointJob
+from tools.HomeCache import HomeCache
+from tools.Tlog import TlogRecorder
+from tools.VelocityStreamer import VelocityStreamer
 # from MavLowLevel import *
 # from CommonStructs import Frames, Waypoint, xyz_to_latlon
 
+# Seconds allowed for each readiness condition during initialisation
+STEP_TIMEOUTS = {'armable': 45.0, 'gps': 45.0, 'home': 10.0}
+
+# Attributes whose updates can change the readiness conditions
+READY_ATTRIBUTES = ('mode', 'gps_0', 'ekf_ok', 'home_location')
+
+
 class BasicArdu():
-    def __init__(self, frame=Frames.LLA, verbose=False, connection_string='tcp:127.0.0.1:5762', tolerance_location=2.0, global_home=None, max_movement_dist=50):
+    def __init__(self, frame=Frames.LLA, verbose=False, connection_string='tcp:127.0.0.1:5762', tolerance_location=2.0, global_home=None, max_movement_dist=50, telemetry_profile='mission', init_timeout=60.0, step_timeouts=None, home_cache='~/.basicardu_home_cache.json', vehicle=None, clock=None, tlog=None):
         '''
         Dronekit wrapper class for Ardupilot
         :param frame: vehicle coordinate frame
@@ -31,33 +43,47 @@ class BasicArdu():
         :param tolerance_location: float for tolerance for reaching waypoint (m)
         :param global_home: array of floats for the global origin of the drones [lat, lon, als (msl)]
         :param max_movement_dist: float for the maximum distance between waypoints in meters
+        :param telemetry_profile: string key of TELEMETRY_PROFILES (or dictionary of message rates) requested at connect, None keeps the autopilot rates
+        :param init_timeout: float seconds allowed for the vehicle to become ready
+        :param step_timeouts: dictionary of seconds allowed per readiness step ('armable', 'gps', 'home'), defaults to STEP_TIMEOUTS
+        :param home_cache: string path of the home location cache file, None to always fetch the home location
+        :param vehicle: already connected vehicle object (ex: tools.SimVehicle), connection_string is ignored if given
+        :param clock: RealClock, or VirtualClock to run against a simulated vehicle on the same clock
+        :param tlog: string path to record all MAVLink traffic to (see tools/Tlog.py), None to not record
         '''
         # Vehicle Connection 
-        self.vehicle = connect(connection_string, wait_ready=False)
+        self.clock = clock or RealClock()
+        start_time = self.clock.time()
+        self.vehicle = vehicle if vehicle is not None else connect(connection_string, wait_ready=False)
+        self.tlog = TlogRecorder(self.vehicle, tlog, self.clock) if tlog else None
+        self.verbose = verbose
+        self.init_timing = {'connect': self.clock.time()-start_time}   # seconds from the start of initialisation to each step
+
+        self.telemetry_profile = None
+        if telemetry_profile:
+            self.set_telemetry_profile(telemetry_profile)
         
         if self.vehicle.armed:                # If the vehicle is already in the air, set to standby mode
             self.vehicle.mode = "GUIDED"
 
-        while not self.vehicle.is_armable:
-            print(" Waiting for vehicle to initialise...")
-            sleep(2)
-        
-        while self.vehicle.gps_0.fix_type < 2:
-            print("Waiting for GPS...:", self.vehicle.gps_0.fix_type)
-            sleep(2)
-
-        # Get Vehicle Home
-        vehicle_home = self.vehicle.home_location
+        # Home location and EKF origin, cached on disk per vehicle boot
+        self.home_cache = HomeCache(home_cache) if home_cache else None
+        self.vehicle_home = self.vehicle.home_location  # LocationGlobal
+        self.ekf_origin = None                          # LocationGlobal
+        self.home_from_cache = False        # True until the cached home has been checked against HOME_POSITION
+        self.home_validated = False         # True once the first HOME_POSITION has been received
+        self.vehicle_identity = None        # (system id, boot time), the cache key
+        self.global_home_from_vehicle = global_home == None
+        self.ready = Condition()            # notified when anything the readiness checks depend on changes
+        self.vehicle.add_message_listener('HOME_POSITION', self.home_position_callback)
+        self.vehicle.add_message_listener('GPS_GLOBAL_ORIGIN', self.origin_callback)
+        self.vehicle.add_message_listener('GLOBAL_POSITION_INT', self.identity_callback)
+
+        # Wait for armable, GPS fix and home location together
+        vehicle_home = self.wait_ready(start_time, init_timeout, step_timeouts or STEP_TIMEOUTS)
         if verbose:
-            print("Getting Vehicle Home")
-        while vehicle_home == None:
-            # Download the vehicle waypoints (commands). Wait until download is complete. Necessary for self.vehicle.home_location to be set
-            cmds = self.vehicle.commands # https://dronekit.netlify.com/automodule.html#dronekit.Vehicle.home_location
-            cmds.download()
-            cmds.wait_ready()
-            vehicle_home = self.vehicle.home_location
-        if verbose:
-            print("Vehicle Home:", vehicle_home)
+            print("Vehicle Home:", vehicle_home, "(cached)" if self.home_from_cache else "")
+            print("Initialization timing (s):", ', '.join('%s %.2f' % item for item in self.init_timing.items()))
 
         # Set Global home location   
         if global_home == None:
@@ -66,18 +92,210 @@ class BasicArdu():
             self.global_home_waypoint.alt = vehicle_home.alt
         else:
             self.global_home_waypoint = Waypoint(x=global_home[0], y=global_home[1], z=global_home[2])
+        self.home_plane = TangentPlane(self.global_home_waypoint)     # NED <-> LLA about the global home
 
 
         # Initialize flight variables
         self.tolerance_location = tolerance_location # minimum distance variance to waypoint (meters)
         self.target_waypoint = Waypoint()                   # current target waypoint
         self.target_waypoint.update(self.vehicle)
+        self.target_tolerance = None                        # arrival radius for the current target, None uses tolerance_location
         self.max_movement_dist = max_movement_dist
 
-        self.verbose = verbose
+        # Asynchronous waypoint jobs
+        self.current_job = None             # WaypointJob in flight, superseded by any new movement command
+        self.jobs = OrderedDict()           # recent jobs by id
+        self.max_jobs = 50
+        self.job_lock = Lock()
+
+        # Blocking movement commands (waypoint, path, mission) stop sending targets once cancelled by land, hold or kill
+        self.movement_generation = 0        # incremented by cancel_movement
+        self.movement_lock = Lock()         # held while a movement command checks it is still current and sends
+
+        # Arrival detection, driven by the position updates from the vehicle
+        self.arrival = Condition()          # notified when the target waypoint is reached
+        self.vehicle.add_attribute_listener('location.global_frame', self.location_callback)
+
+        self.velocity_streamer = None       # VelocityStreamer while Frames.VEL setpoints are being streamed
+        self.velocity_lock = Lock()         # held while the stream is started or stopped, so only one is ever running
+
+        # Autopilot (AUTO mode) missions
+        self.mission_waypoints = []         # Waypoint objects of the uploaded mission
+        self.mission_reached = []           # (index, time) of every mission waypoint reached so far
+        self.mission_item_reached = None    # optional function(index, waypoint) called per reached waypoint
+        self.mission_complete = Event()
+        self.vehicle.add_message_listener('MISSION_ITEM_REACHED', self.mission_item_callback)
         
         print(' - - - Initialization Successful - - -')
 
+    def wait_ready(self, start_time, timeout, step_timeouts):
+        '''
+        Method to wait until the vehicle is armable, has a GPS fix and has a home location. The conditions are
+        waited on together and re-checked whenever a related attribute or message arrives. The home location
+        comes from the home cache if this boot of the vehicle is in it, otherwise it is requested directly;
+        the mission is only downloaded if HOME_POSITION never arrives.
+        :param start_time: float clock time that initialisation started, the timing and timeouts are measured from it
+        :param timeout: float seconds allowed for all of the conditions
+        :param step_timeouts: dictionary of seconds allowed per condition ('armable', 'gps', 'home')
+        :return: LocationGlobal of the vehicle home
+        '''
+        def attribute_callback(vehicle, attr_name, value):
+            with self.ready:
+                self.ready.notify_all()
+
+        checks = {
+            'armable': lambda: self.vehicle.is_armable,
+            'gps': lambda: self.vehicle.gps_0 is not None and (self.vehicle.gps_0.fix_type or 0) >= 2,
+            'home': lambda: self.vehicle_home is not None,
+        }
+
+        for attr_name in READY_ATTRIBUTES:
+            self.vehicle.add_attribute_listener(attr_name, attribute_callback)
+        try:
+            # always asked for once, a cached home is validated against the answer
+            request_home_position(self.vehicle)
+            request_message(self.vehicle, 'GPS_GLOBAL_ORIGIN')
+            last_request = self.clock.time()
+            last_print = self.clock.time()
+            cache_checked = self.home_cache is None
+            with self.ready:
+                while True:
+                    elapsed = self.clock.time()-start_time
+                    if not cache_checked and self.vehicle_identity and self.vehicle_home is None:
+                        cache_checked = True
+                        self.load_home_cache()
+
+                    for step, check in checks.items():
+                        if step not in self.init_timing and check():
+                            self.init_timing[step] = elapsed
+                    pending = [step for step in checks if step not in self.init_timing]
+                    if not pending:
+                        break
+
+                    if pending == ['home'] and elapsed > step_timeouts['home']:
+                        self.ready.release()        # the listeners must keep running during the download
+                        try:
+                            self.vehicle_home = self.download_home(timeout - elapsed)
+                        finally:
+                            self.ready.acquire()
+                        continue
+                    late = [step for step in pending if step != 'home' and elapsed > step_timeouts[step]]
+                    if late or elapsed > timeout:
+                        raise TimeoutError('Vehicle not ready after %.1f s, waiting for: %s' % (elapsed, ', '.join(pending)))
+
+                    if 'home' in pending and self.clock.time()-last_request > 1.0:
+                        request_home_position(self.vehicle)
+                        last_request = self.clock.time()
+                    if self.clock.time()-last_print > 2.0:
+                        print(" Waiting for vehicle to initialise...", ', '.join(pending))
+                        last_print = self.clock.time()
+                    self.clock.wait_for(self.ready, lambda: any(checks[step]() for step in pending) or
+                                        (not cache_checked and self.vehicle_identity is not None), 0.5)
+        finally:
+            for attr_name in READY_ATTRIBUTES:
+                self.vehicle.remove_attribute_listener(attr_name, attribute_callback)
+
+        self.save_home_cache()
+        self.init_timing['total'] = self.clock.time()-start_time
+        return self.vehicle_home
+
+    def identity_callback(self, vehicle, name, msg):
+        '''
+        dronekit listener for GLOBAL_POSITION_INT, records the system id and boot time of the vehicle from the first message
+        '''
+        if self.vehicle_identity is None:
+            with self.ready:
+                self.vehicle_identity = (msg.get_srcSystem(), self.clock.time() - msg.time_boot_ms/1000.0)
+                self.ready.notify_all()
+
+    def home_position_callback(self, vehicle, name, msg):
+        '''
+        dronekit listener for HOME_POSITION. The first message sets the home location, replacing a stale cached one
+        '''
+        if self.home_validated:
+            return
+        home = LocationGlobal(msg.latitude/1e7, msg.longitude/1e7, msg.altitude/1000.0)
+        with self.ready:
+            self.home_validated = True
+            if self.home_from_cache:
+                cached = Waypoint(x=self.vehicle_home.lat, y=self.vehicle_home.lon, z=self.vehicle_home.alt)
+                if cached.current_distance(None, Waypoint(x=home.lat, y=home.lon, z=home.alt)) > 1.0:
+                    print('WARNING: CACHED HOME LOCATION WAS STALE, USING', home)
+                    if self.global_home_from_vehicle and hasattr(self, 'global_home_waypoint'):
+                        self.global_home_waypoint.alt = home.alt
+                        self.home_plane = TangentPlane(self.global_home_waypoint)
+                self.home_from_cache = False
+            self.vehicle_home = home
+            self.ready.notify_all()
+        self.save_home_cache()
+
+    def origin_callback(self, vehicle, name, msg):
+        '''
+        dronekit listener for GPS_GLOBAL_ORIGIN, the EKF origin of the vehicle
+        '''
+        self.ekf_origin = LocationGlobal(msg.latitude/1e7, msg.longitude/1e7, msg.altitude/1000.0)
+        self.save_home_cache()
+
+    def load_home_cache(self):
+        '''
+        Method to take the home location and EKF origin from the cache, if this boot of the vehicle is in it
+        '''
+        entry = self.home_cache.lookup(*self.vehicle_identity)
+        if entry is None or entry['home'] is None:
+            return
+        self.vehicle_home = LocationGlobal(*entry['home'])
+        self.home_from_cache = not self.home_validated
+        if entry['origin'] is not None and self.ekf_origin is None:
+            self.ekf_origin = LocationGlobal(*entry['origin'])
+        if self.verbose:
+            print("Vehicle Home from cache:", self.vehicle_home)
+
+    def save_home_cache(self):
+        '''
+        Method to store the confirmed home location and EKF origin for the current boot of the vehicle
+        '''
+        if self.home_cache is None or self.vehicle_identity is None or self.home_from_cache:
+            return
+        home = self.vehicle_home
+        origin = self.ekf_origin
+        self.home_cache.store(*self.vehicle_identity,
+            home=[home.lat, home.lon, home.alt] if home else None,
+            origin=[origin.lat, origin.lon, origin.alt] if origin else None)
+
+    def close(self):
+        '''
+        Method to stop the velocity stream, finish the traffic log and close the vehicle connection
+        '''
+        self.stop_velocity_stream(zero=False)
+        if self.tlog:
+            self.tlog.close()
+        self.vehicle.close()
+
+    def download_home(self, timeout):
+        '''
+        Method to get the home location by downloading the vehicle commands, for autopilots that do not answer HOME_POSITION requests
+        :param timeout: float seconds allowed for the download
+        :return: LocationGlobal of the vehicle home
+        '''
+        if self.verbose:
+            print("Getting Vehicle Home from the mission download")
+        cmds = self.vehicle.commands # https://dronekit.netlify.com/automodule.html#dronekit.Vehicle.home_location
+        cmds.download()
+        cmds.wait_ready(timeout=max(timeout, 1.0))
+        if self.vehicle.home_location is None:
+            raise TimeoutError('Vehicle home location not available')
+        return self.vehicle.home_location
+
+    def set_telemetry_profile(self, profile):
+        '''
+        Method to set the telemetry message rates. Position rate bounds how quickly arrival is detected
+        :param profile: string key of TELEMETRY_PROFILES ('mission', 'idle') or dictionary of message name -> rate in Hz
+        '''
+        if self.verbose:
+            print('> Telemetry profile:', profile)
+        set_telemetry_profile(self.vehicle, profile)
+        self.telemetry_profile = profile
+
     def handle_arm(self):
         '''
         Method to arm the vehicle
@@ -100,6 +318,9 @@ class BasicArdu():
         '''
         Method to emergency stop motors
         '''
+        self.cancel_movement()
+        self.supersede_job()
+        self.stop_velocity_stream(zero=False)
         kill_vehicle(self.vehicle)
         if self.verbose:
             print('> Emergency Stop')
@@ -107,8 +328,10 @@ class BasicArdu():
     def handle_takeoff(self, alt, phi=0):
         '''
         Method to takeoff the vehicle
+        :return: Boolean, False if the takeoff was cancelled (land, hold or kill) before reaching alt
         '''
         print('~~ Take Off ~~')
+        generation = self.movement_generation
 
         self.vehicle.mode = "GUIDED"
         self.vehicle.armed=True
@@ -116,49 +339,377 @@ class BasicArdu():
         # We want for the motors to arm before we takeoff
         while not self.vehicle.armed:
             print("Waiting for arming...")
-            sleep(0.5)
+            if self.wait_cancelled(0.5, generation):
+                return False
 
-        self.vehicle.wait_simple_takeoff(alt)
+        # Polled rather than wait_simple_takeoff, which would keep waiting for the altitude after a landing
+        self.vehicle.simple_takeoff(alt)
+        while (self.vehicle.location.global_relative_frame.alt or 0.0) < alt - 0.1:
+            if self.wait_cancelled(0.1, generation):
+                return False
+        return True
          
     def handle_landing(self):
         '''
         Method to land the vehicle
         '''
         print("~~ Landing ~~")
+        self.cancel_movement()
+        self.supersede_job()
+        self.stop_velocity_stream()
         land_vehicle(self.vehicle)
         while self.vehicle.armed:
-            sleep(0.5)
+            self.clock.sleep(0.5)
 
-    def handle_waypoint(self, frame, x, y, z, phi=0):
+    def handle_waypoint(self, frame, x, y, z, phi=0, generation=None):
         '''
         Method to send the vehicle to a new waypoint
         :param frame: Frame Enum frame of reference for the waypoint command
         x, y, z depend on the frames (NED: x:meters north, y:meters east, z: meters down) (LLA: x:Lat, y: Lon, z:alt msl meters)
+        :param generation: movement_generation the command belongs to, nothing is sent once it is cancelled (None: the current one)
+        :return: Boolean for if the waypoint was reached
         '''
-        if self.verbose:
-            print('> Waypoint CMD')
+        generation = self.movement_generation if generation is None else generation
+        if self.send_waypoint(frame, x, y, z, phi, generation):
+            return self.wait_for_target(generation=generation)
+        return False
 
-        if frame.value == Frames.VEL.value:   # velocity command
-            print('VELOCITY')
-            velocity_cmd_NED(self.vehicle, x, y, z, phi)
-            self.target_waypoint=None 
-        else:
-            if frame.value == Frames.LLA.value: # If LLA, set target directly
-                print('LLA', x, y, z, phi)
-                self.target_waypoint = Waypoint( x=x, y=y, z=z, compass_angle=phi)
+    def send_waypoint(self, frame, x, y, z, phi=0, generation=None):
+        '''
+        Method to send a waypoint command without waiting for the vehicle to reach it
+        :param frame: Frame Enum frame of reference for the waypoint command
+        :param generation: movement_generation the command belongs to, nothing is sent once it is cancelled (None: always send)
+        :return: Boolean for if a target waypoint was set
+        '''
+        with self.movement_lock:
+            if self.movement_cancelled(generation):
+                return False
+            self.supersede_job()
+            self.target_tolerance = None
+            if self.verbose:
+                print('> Waypoint CMD')
+
+            if frame.value == Frames.VEL.value:   # velocity command
+                print('VELOCITY')
+                streamer = self.velocity_streamer
+                if streamer:
+                    streamer.set_velocity(x, y, z, phi)
+                else:
+                    velocity_cmd_NED(self.vehicle, x, y, z, phi)
+                self.target_waypoint=None 
+            else:
+                self.stop_velocity_stream(zero=False)
+                if frame.value == Frames.LLA.value: # If LLA, set target directly
+                    print('LLA', x, y, z, phi)
+                    self.target_waypoint = Waypoint( x=x, y=y, z=z, compass_angle=phi)
 
-            elif frame.value == Frames.NED.value:   # if NED, convert to LLA
-                print('NED', x, y, z, phi)
-                self.target_waypoint = xyz_to_latlon(self.global_home_waypoint, x, y, z)
+                elif frame.value == Frames.NED.value:   # if NED, convert to LLA
+                    print('NED', x, y, z, phi)
+                    self.target_waypoint = self.home_plane.waypoint(x, y, z, phi)
 
-            if self.target_waypoint.current_distance(self.vehicle) <= self.max_movement_dist:
-                waypoint_cmd_LLA(self.vehicle, self.target_waypoint.lat, self.target_waypoint.lon, self.target_waypoint.alt, phi)
+                if self.target_waypoint.current_distance(self.vehicle) <= self.max_movement_dist:
+                    waypoint_cmd_LLA(self.vehicle, self.target_waypoint.lat, self.target_waypoint.lon, self.target_waypoint.alt, phi)
+                else:
+                    print('Cancelling Movement - Waypoint Too Far Away')
+                    self.target_waypoint = None
+
+            return self.target_waypoint is not None
+
+    def start_waypoint(self, frame, x, y, z, phi=0, timeout=15.0):
+        '''
+        Method to send the vehicle to a new waypoint without blocking
+        :param frame: Frame Enum frame of reference for the waypoint command
+        :param timeout: float seconds before the job is marked as timed out
+        :return: WaypointJob handle. Velocity commands have no target and finish immediately, rejected waypoints finish as FAILED
+        '''
+        target_set = self.send_waypoint(frame, x, y, z, phi)
+        job = WaypointJob(self.target_waypoint if target_set else Waypoint(x=x, y=y, z=z, compass_angle=phi), timeout, self.clock)
+
+        with self.job_lock:
+            self.jobs[job.id] = job
+            while len(self.jobs) > self.max_jobs:
+                self.jobs.popitem(last=False)
+
+            if not target_set:
+                job.finish(JobStatus.REACHED if frame.value == Frames.VEL.value else JobStatus.FAILED)
             else:
-                print('Cancelling Movement - Waypoint Too Far Away')
+                self.current_job = job
+                self.clock.call_later(timeout, self.job_timeout, job)
+        return job
+
+    def job_timeout(self, job):
+        '''
+        Clock callback to end a job that has not reached its target in time
+        :param job: WaypointJob to check
+        '''
+        if job.is_running():
+            print("WARNING: WAYPOINT NEVER REACHED")
+            job.finish(JobStatus.TIMEOUT)
+
+    def location_callback(self, vehicle, attr_name, value):
+        '''
+        dronekit listener for 'location.global_frame'. Checks arrival on every position message, so
+        waiting callers and jobs are released within one telemetry message of reaching the target
+        '''
+        job = self.current_job
+        if job and job.is_running():
+            distance = job.target.current_distance(self.vehicle, mode=Geodesy.EQUIRECTANGULAR)     # mm error at tolerance range
+            job.update(distance, self.vehicle.groundspeed)
+            if distance <= self.tolerance_location:
+                job.finish(JobStatus.REACHED)
+
+        with self.arrival:
+            if self.target_waypoint and self.reached_target():
+                self.arrival.notify_all()
+
+    def supersede_job(self):
+        '''
+        Method to mark the job in flight as superseded by a new command
+        '''
+        with self.job_lock:
+            if self.current_job:
+                self.current_job.finish(JobStatus.SUPERSEDED)
+                self.current_job = None
+
+    def cancel_movement(self):
+        '''
+        Method to stop the blocking movement command in progress, if any. It sends no further targets and its
+        wait returns straight away
+        '''
+        with self.movement_lock:
+            self.movement_generation += 1
+        with self.arrival:
+            self.arrival.notify_all()
+
+    def movement_cancelled(self, generation):
+        '''
+        :param generation: movement_generation a command started with, or None
+        :return: Boolean for if cancel_movement has been called since
+        '''
+        return generation is not None and generation != self.movement_generation
+
+    def wait_cancelled(self, timeout, generation):
+        '''
+        Method to pause a movement sequence, returning early if it is cancelled
+        :param timeout: float seconds to pause
+        :param generation: movement_generation the sequence started with
+        :return: Boolean for if the sequence was cancelled
+        '''
+        with self.arrival:
+            return self.clock.wait_for(self.arrival, lambda: self.movement_cancelled(generation), timeout)
+
+    def get_job(self, job_id):
+        '''
+        Method to look up a recent job
+        :param job_id: integer job id
+        :return: WaypointJob or None
+        '''
+        return self.jobs.get(job_id)
+
+    def start_velocity_stream(self, rate_hz=20.0, watchdog_timeout=1.0):
+        '''
+        Method to start re-sending the Frames.VEL setpoint at a fixed rate. Setpoints are then updated with
+        handle_waypoint(Frames.VEL, ...) or set_velocity, and are zeroed if not refreshed within watchdog_timeout
+        :param rate_hz: float setpoint messages per second
+        :param watchdog_timeout: float seconds without an update before the vehicle is stopped
+        :return: VelocityStreamer object
+        '''
+        with self.velocity_lock:
+            if self.velocity_streamer is None:
+                if self.verbose:
+                    print('> Velocity stream', rate_hz, 'Hz')
+                self.velocity_streamer = VelocityStreamer(self.vehicle, rate_hz, watchdog_timeout, self.clock)
+                self.velocity_streamer.start()
+            return self.velocity_streamer
+
+    def stop_velocity_stream(self, zero=True):
+        '''
+        Method to stop the velocity setpoint stream
+        :param zero: boolean, send a final zero velocity setpoint
+        :return: dictionary of the stream timing statistics, or None if no stream was running
+        '''
+        with self.velocity_lock:
+            streamer = self.velocity_streamer
+            if streamer is None:
+                return None
+            self.velocity_streamer = None
+            streamer.stop(zero)
+        return streamer.stats()
+
+    def set_velocity(self, vNorth, vEast, vDown, yaw=0.0, rate_hz=20.0):
+        '''
+        Method to update the streamed velocity setpoint, starting the stream if needed. Any running waypoint,
+        path or mission is cancelled first, its targets would fight the setpoints
+        :param vNorth: float m/s north
+        :param vEast: float m/s east
+        :param vDown: float m/s down
+        :param yaw: float of the desired yaw angle (radians)
+        :param rate_hz: float setpoint messages per second, if the stream is started here
+        :return: VelocityStreamer object
+        '''
+        self.cancel_movement()
+        self.supersede_job()
+        self.leave_mission()
+        self.target_waypoint = None
+        streamer = self.start_velocity_stream(rate_hz=rate_hz)
+        streamer.set_velocity(vNorth, vEast, vDown, yaw)
+        return streamer
+
+    def handle_path(self, waypoints, lookahead=5.0, timeout=15.0, generation=None):
+        '''
+        Method to follow a list of waypoints without stopping at the intermediate ones. The next waypoint is
+        sent as soon as the vehicle is within the lookahead radius of the current one, so corners are passed
+        at cruise speed. Only the last waypoint is flown to tolerance_location.
+        :param waypoints: list of Waypoint objects (LLA, alt msl)
+        :param lookahead: float meters from an intermediate waypoint at which the next one is sent
+        :param timeout: float seconds allowed per leg
+        :param generation: movement_generation the path belongs to (None: the current one)
+        :return: Boolean for if the last waypoint was reached
+        '''
+        print('~~ Path ~~')
+        generation = self.movement_generation if generation is None else generation
+        lookahead = max(lookahead, self.tolerance_location)
+
+        self.stop_velocity_stream(zero=False)
+        for index, waypoint in enumerate(waypoints):
+            self.supersede_job()
+            if waypoint.current_distance(self.vehicle) > self.max_movement_dist:
+                print('Cancelling Path - Waypoint Too Far Away')
                 self.target_waypoint = None
+                return False
 
-        if self.target_waypoint:
-            self.wait_for_target()
+            last = index == len(waypoints)-1
+            with self.movement_lock:
+                if self.movement_cancelled(generation):
+                    return False
+                self.target_tolerance = None if last else lookahead
+                self.target_waypoint = waypoint
+                waypoint_cmd_LLA(self.vehicle, waypoint.lat, waypoint.lon, waypoint.alt, waypoint.phi)
+
+            if not self.wait_for_target(timeout, generation):
+                return False
+        return True
+
+    def upload_mission(self, waypoints, timeout=10.0, retry_interval=1.0):
+        '''
+        Method to upload a list of waypoints to the autopilot in one mission transaction (MISSION_ITEM_INT)
+        :param waypoints: list of Waypoint objects (LLA, alt msl)
+        :param timeout: float seconds for the whole transaction
+        :param retry_interval: float seconds without item requests before MISSION_COUNT is resent
+        :return: Boolean for if the autopilot accepted the mission
+        '''
+        home = self.global_home_waypoint
+        items = [mission_item_int(self.vehicle, 0, home.lat, home.lon, home.alt)]     # seq 0 is the home location
+        for seq, waypoint in enumerate(waypoints, start=1):
+            items.append(mission_item_int(self.vehicle, seq, waypoint.lat, waypoint.lon, waypoint.alt, waypoint.phi))
+
+        ack = {}
+        finished = Event()
+        last_request = [0.0]
+
+        def request_callback(vehicle, name, msg):
+            if msg.seq < len(items):
+                last_request[0] = self.clock.time()
+                self.vehicle.send_mavlink(items[msg.seq])
+
+        def ack_callback(vehicle, name, msg):
+            ack['type'] = msg.type
+            finished.set()
+
+        for name in ('MISSION_REQUEST_INT', 'MISSION_REQUEST'):
+            self.vehicle.add_message_listener(name, request_callback)
+        self.vehicle.add_message_listener('MISSION_ACK', ack_callback)
+        try:
+            start_time = self.clock.time()
+            while not finished.is_set() and self.clock.time()-start_time < timeout:
+                if self.clock.time()-last_request[0] > retry_interval:     # nothing requested yet or transfer stalled
+                    last_request[0] = self.clock.time()
+                    mission_count(self.vehicle, len(items))
+                self.clock.wait_event(finished, 0.1)
+        finally:
+            for name in ('MISSION_REQUEST_INT', 'MISSION_REQUEST'):
+                self.vehicle.remove_message_listener(name, request_callback)
+            self.vehicle.remove_message_listener('MISSION_ACK', ack_callback)
+
+        accepted = ack.get('type') == mavutil.mavlink.MAV_MISSION_ACCEPTED
+        if self.verbose:
+            print('> Mission upload:', len(waypoints), 'waypoints', 'accepted' if accepted else 'FAILED %s' % ack.get('type'))
+        return accepted
+
+    def handle_mission(self, waypoints, wait=True, item_reached=None, timeout=None, generation=None):
+        '''
+        Method to fly a list of waypoints as an autopilot mission in AUTO mode, so the autopilot sequences
+        the legs without a host round trip per waypoint. The vehicle should already be flying.
+        :param waypoints: list of Waypoint objects (LLA, alt msl)
+        :param wait: boolean, block until the last waypoint has been reached
+        :param item_reached: function(index, waypoint) called as each waypoint is reached
+        :param timeout: float seconds to wait for the mission (None waits until it is complete)
+        :param generation: movement_generation the mission belongs to (None: the current one)
+        :return: Boolean, True if the mission was started (wait=False) or completed (wait=True)
+        '''
+        print('~~ Mission ~~')
+        generation = self.movement_generation if generation is None else generation
+        self.supersede_job()
+        self.stop_velocity_stream(zero=False)
+        self.target_waypoint = None
+        self.mission_waypoints = []         # stays empty if the upload fails
+
+        if not self.upload_mission(waypoints):
+            print('Cancelling Mission - Upload Failed')
+            return False
+
+        self.mission_waypoints = list(waypoints)
+        self.mission_reached = []
+        self.mission_item_reached = item_reached
+        self.mission_complete.clear()
+
+        with self.movement_lock:
+            if self.movement_cancelled(generation):
+                return False
+            mission_set_current(self.vehicle, 1)
+            self.vehicle.mode = VehicleMode("AUTO")
+
+        if wait:
+            with self.arrival:
+                self.clock.wait_for(self.arrival, lambda: self.mission_complete.is_set() or self.movement_cancelled(generation), timeout)
+            if not self.mission_complete.is_set():
+                print("WARNING: MISSION NOT COMPLETED")
+                return False
+        return True
+
+    def mission_timeout(self, waypoints, speed=2.0, margin=15.0):
+        '''
+        Method to bound how long a mission should take, from its length
+        :param waypoints: list of Waypoint objects (LLA, alt msl)
+        :param speed: float m/s, below the autopilot waypoint speed so slow legs are not cut short
+        :param margin: float seconds added for the mode change and each arrival
+        :return: float seconds
+        '''
+        distance = 0.0
+        previous = None
+        for waypoint in waypoints:
+            distance += waypoint.current_distance(self.vehicle, previous)
+            previous = waypoint
+        return distance / speed + margin * (1 + len(waypoints))
+
+    def mission_item_callback(self, vehicle, name, msg):
+        '''
+        dronekit listener for MISSION_ITEM_REACHED, records the reached waypoint and ends the mission after the last one
+        '''
+        index = msg.seq - 1             # seq 0 is the home location
+        if index < 0 or index >= len(self.mission_waypoints) or self.mission_complete.is_set():
+            return
+        self.mission_reached.append((index, self.clock.time()))
+        if self.verbose:
+            print('Reached mission waypoint', index)
+        if self.mission_item_reached:
+            self.mission_item_reached(index, self.mission_waypoints[index])
+
+        if index == len(self.mission_waypoints)-1:
+            self.vehicle.mode = VehicleMode("GUIDED")       # hold at the last waypoint, ready for guided commands
+            self.mission_complete.set()
+            with self.arrival:
+                self.arrival.notify_all()
 
     def handle_hold(self):
         '''
@@ -167,14 +718,21 @@ class BasicArdu():
         if self.verbose:
             print('> Hold')
 
+        self.cancel_movement()
+        self.supersede_job()
+        self.stop_velocity_stream(zero=False)
+        self.leave_mission()
         self.target_waypoint = Waypoint()     # Clear the target waypoint
         self.target_waypoint.update(self.vehicle)       # Update the target location to the current location of the vehicle
         # Set the vehicle to go to the target waypoint
-        if self.target_waypoint.frame == Frames.LLA:
-            waypoint_cmd_LLA(self.vehicle, self.target_waypoint.lat, self.target_waypoint.lon, self.target_waypoint.alt, self.target_waypoint.phi)
-        
-        elif self.target_waypoint.frame == Frames.NED:
-            waypoint_cmd_NED(self.vehicle, self.target_waypoint.dNorth, self.target_waypoint.dEast, self.target_waypoint.dDown, self.target_waypoint.phi)
+        waypoint_cmd_LLA(self.vehicle, self.target_waypoint.lat, self.target_waypoint.lon, self.target_waypoint.alt, self.target_waypoint.phi)
+
+    def leave_mission(self):
+        '''
+        Method to switch out of an AUTO mission to GUIDED, position and velocity targets are ignored during a mission
+        '''
+        if self.vehicle.mode.name == 'AUTO':
+            self.vehicle.mode = VehicleMode("GUIDED")
 
     def reached_target(self):
         '''
@@ -183,30 +741,38 @@ class BasicArdu():
         '''
         if self.target_waypoint:
             
-            if self.target_waypoint.current_distance(self.vehicle) <= self.tolerance_location:
+            if self.target_waypoint.current_distance(self.vehicle, mode=Geodesy.EQUIRECTANGULAR) <= (self.target_tolerance or self.tolerance_location):
                 self.target_waypoint = None 
+                return True
             else:
                 return False
         
         else:               # if the drone has reached its target, then the target waypoint is set to None
             return True
 
-    def wait_for_target(self):
+    def wait_for_target(self, timeout=15.0, generation=None):
         ''' 
         Method to delay code progression until the target location has been reached
+        :param timeout: float seconds to wait if stuck travelling to a waypoint
+        :param generation: movement_generation of the command waiting, the wait ends early if it is cancelled
+        :return: Boolean for if the target was reached before the timeout
         '''
-        start_time = time()
-        while not self.reached_target():
-            sleep(0.5)
-
-            if time()-start_time>15.0:      # timeout for if stuck travelling to a waypoint
-                print("WARNING: WAYPOINT NEVER REACHED")
+        with self.arrival:
+            reached = self.clock.wait_for(self.arrival, lambda: self.movement_cancelled(generation) or self.reached_target(), timeout)
+
+        if self.movement_cancelled(generation):
+            if self.verbose:
+                print('Movement cancelled')
+            return False
+        if not reached:
+            print("WARNING: WAYPOINT NEVER REACHED")
+            if self.target_waypoint:
                 print("Distance to target:", self.target_waypoint.current_distance(self.vehicle))
-                break
+            return False
 
         if self.verbose:
             print('Reached Target')
-
+        return True
     
     def get_LLA(self):
         '''
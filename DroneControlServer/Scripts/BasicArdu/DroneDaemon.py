@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+
+'''
+Persistent drone control daemon. Keeps one BasicArdu connection open per vehicle and
+accepts newline delimited JSON commands over a local TCP socket, so web clicks do not
+pay for a fresh dronekit connection every time.
+
+Request:  {"command": "takeoff", "args": {"alt": 2}, "vehicle": "drone1"}
+Reply:    {"success": true, "result": null}
+'''
+from argparse import ArgumentParser
+from threading import Lock
+import json
+import socket
+import socketserver
+
+import numpy as np
+
+from BasicArdu import BasicArdu, Frames, Waypoint
+from tools.CommonStructs import WaypointArray
+from Telemetry import TelemetryHub
+from tools.SimVehicle import SimVehicle
+
+
+# Named movement routines served by the control page, as (frame, x, y, z, phi) waypoints
+ROUTINES = {
+    'square': [(Frames.NED, 5.0, 0, -5.0, 0), (Frames.NED, 5.0, 5.0, -5.0, 0), (Frames.NED, 0, 5.0, -5.0, 0), (Frames.NED, 0, 0, -5.0, 0)],
+    'vertical': [(Frames.NED, 0.0, 0, -20.0, 0)],
+    'left': [(Frames.NED, 0.0, -5.0, -5.0, 0)],
+    'right': [(Frames.NED, 0.0, 5.0, -5.0, 0)],
+    'front': [(Frames.NED, 5.0, 0, -5.0, 0)],
+    'back': [(Frames.NED, -5.0, 0, -5.0, 0)],
+}
+
+# Commands that must never queue behind a running movement command
+# ('velocity' only updates the streamed setpoint, 'land' and 'hold' cancel the running movement command)
+UNLOCKED_COMMANDS = ('state', 'kill', 'job', 'velocity', 'land', 'hold')
+
+
+class DroneDaemon():
+    def __init__(self, vehicles, verbose=False):
+        '''
+        Owns the BasicArdu connections and dispatches commands to them
+        :param vehicles: dictionary of vehicle name to connection string ('sim' for an in-process simulated vehicle)
+        :param verbose: boolean for extra text outputs
+        '''
+        self.drones = {}
+        self.locks = {}             # one lock per vehicle so commands to the same vehicle are serialized
+        self.telemetry = {}         # one TelemetryHub per vehicle, shared by all stream viewers
+        for name, connection_string in vehicles.items():
+            print('Connecting to', name, 'at', connection_string)
+            if connection_string == 'sim':
+                self.drones[name] = BasicArdu(verbose=verbose, vehicle=SimVehicle(), home_cache=None)
+            else:
+                self.drones[name] = BasicArdu(connection_string=connection_string, verbose=verbose)
+            self.locks[name] = Lock()
+            self.telemetry[name] = TelemetryHub(self.drones[name].vehicle, name)
+        self.default_vehicle = next(iter(vehicles))
+        self.verbose = verbose
+
+        self.commands = {
+            'arm': self.cmd_arm,
+            'disarm': self.cmd_disarm,
+            'guided': self.cmd_guided,
+            'takeoff': self.cmd_takeoff,
+            'land': self.cmd_land,
+            'goto': self.cmd_goto,
+            'hold': self.cmd_hold,
+            'kill': self.cmd_kill,
+            'state': self.cmd_state,
+            'job': self.cmd_job,
+            'telemetry': self.cmd_telemetry,
+            'mission': self.cmd_mission,
+            'path': self.cmd_path,
+            'velocity': self.cmd_velocity,
+            'velocity_stop': self.cmd_velocity_stop,
+            'waypoint_test': self.cmd_waypoint_test,
+        }
+        for routine in ROUTINES:
+            self.commands[routine] = self.cmd_routine
+
+    def handle_command(self, request):
+        '''
+        Method to run a single command request
+        :param request: dictionary with 'command' and optional 'args' and 'vehicle' entries
+        :return: dictionary reply with 'success' and either 'result' or 'error'
+        '''
+        name = request.get('vehicle') or self.default_vehicle
+        command = request.get('command')
+        args = request.get('args') or {}
+
+        if name not in self.drones:
+            return {'success': False, 'error': 'unknown vehicle: %s' % name}
+        if command not in self.commands:
+            return {'success': False, 'error': 'unknown command: %s' % command}
+        if command in ROUTINES:
+            args = dict(args, routine=command)
+
+        if self.verbose:
+            print('>', name, command, args)
+
+        try:
+            if command in UNLOCKED_COMMANDS:
+                result = self.commands[command](self.drones[name], **args)
+            else:
+                with self.locks[name]:
+                    result = self.commands[command](self.drones[name], **args)
+        except Exception as e:
+            return {'success': False, 'error': str(e)}
+        return {'success': True, 'result': result}
+
+    def close(self):
+        '''
+        Method to close all of the vehicle connections
+        '''
+        for hub in self.telemetry.values():
+            hub.close()
+        for drone in self.drones.values():
+            drone.close()
+
+    def cmd_arm(self, drone):
+        drone.handle_arm()
+
+    def cmd_disarm(self, drone):
+        drone.vehicle.armed = False
+
+    def cmd_guided(self, drone):
+        drone.handle_guided()
+
+    def cmd_takeoff(self, drone, alt=2):
+        drone.handle_arm()
+        drone.handle_takeoff(float(alt))
+
+    def cmd_land(self, drone):
+        drone.handle_landing()
+
+    def cmd_goto(self, drone, frame='NED', x=0.0, y=0.0, z=0.0, phi=0.0, wait=True):
+        if wait in (False, 'false', '0'):
+            # returns straight away, progress is polled with the 'job' command
+            return drone.start_waypoint(Frames(frame), float(x), float(y), float(z), float(phi)).to_dict()
+        drone.handle_waypoint(Frames(frame), float(x), float(y), float(z), float(phi))
+
+    def cmd_hold(self, drone):
+        drone.handle_hold()
+
+    def cmd_kill(self, drone):
+        drone.handle_kill()
+
+    def cmd_state(self, drone):
+        return get_state(drone)
+
+    def cmd_job(self, drone, id=None):
+        if id is None:
+            return drone.current_job.to_dict() if drone.current_job else None
+        job = drone.get_job(int(id))
+        if job is None:
+            raise ValueError('unknown job: %s' % id)
+        return job.to_dict()
+
+    def cmd_telemetry(self, drone, profile='mission'):
+        drone.set_telemetry_profile(profile)
+
+    def cmd_mission(self, drone, waypoints, frame='LLA', wait=True):
+        '''
+        :param waypoints: list of [x, y, z] or [x, y, z, phi] in the given frame (LLA or NED)
+        '''
+        mission = to_waypoint_array(drone, Frames(frame), waypoints)
+        return fly_mission(drone, mission, wait=wait not in (False, 'false', '0'))
+
+    def cmd_path(self, drone, waypoints, frame='LLA', lookahead=5.0):
+        '''
+        :param waypoints: list of [x, y, z] or [x, y, z, phi] in the given frame (LLA or NED)
+        '''
+        path = to_waypoint_array(drone, Frames(frame), waypoints)
+        return drone.handle_path(path, lookahead=float(lookahead))
+
+    def cmd_velocity(self, drone, vn=0.0, ve=0.0, vd=0.0, yaw=0.0, rate=20.0):
+        # the setpoint is re-sent by the stream until updated again or the watchdog zeroes it,
+        # a running goto, path or mission is cancelled first
+        return drone.set_velocity(float(vn), float(ve), float(vd), float(yaw), rate_hz=float(rate)).stats()
+
+    def cmd_velocity_stop(self, drone):
+        return drone.stop_velocity_stream()
+
+    def cmd_routine(self, drone, routine, mission=False, path=False):
+        if mission in (True, 'true', '1'):
+            # flown as one autopilot mission instead of one guided command per leg
+            return fly_mission(drone, [to_waypoint(drone, *point) for point in ROUTINES[routine]])
+        if path in (True, 'true', '1'):
+            # blended through the corners without stopping
+            return drone.handle_path([to_waypoint(drone, *point) for point in ROUTINES[routine]])
+        generation = drone.movement_generation
+        for frame, x, y, z, phi in ROUTINES[routine]:
+            if drone.movement_cancelled(generation):
+                break
+            drone.handle_waypoint(frame, x, y, z, phi, generation)
+
+    def cmd_waypoint_test(self, drone):
+        # same sequence as waypointTesting.py, stopped by land, hold or kill
+        generation = drone.movement_generation
+        drone.handle_takeoff(20)
+        if drone.wait_cancelled(10, generation):
+            return
+        drone.handle_waypoint(Frames.NED, 0, 0, -25.0, 0, generation)
+        if drone.wait_cancelled(7, generation):
+            return
+        drone.handle_waypoint(Frames.NED, 10.0, 0, -25.0, 0, generation)
+        if drone.wait_cancelled(7, generation):
+            return
+        drone.handle_waypoint(Frames.NED, 0, 0, -20.0, 0, generation)
+        if drone.wait_cancelled(10, generation):
+            return
+        drone.handle_landing()
+        drone.vehicle.armed = False
+
+
+def to_waypoint(drone, frame, x, y, z, phi=0.0):
+    '''
+    Function to convert a position to an LLA Waypoint
+    :param drone: BasicArdu object, its global home is the NED origin
+    :param frame: Frames.LLA or Frames.NED
+    :return: Waypoint object
+    '''
+    if frame.value == Frames.NED.value:
+        return drone.home_plane.waypoint(float(x), float(y), float(z), float(phi))
+    return Waypoint(x=float(x), y=float(y), z=float(z), compass_angle=float(phi))
+
+
+def to_waypoint_array(drone, frame, points):
+    '''
+    Function to convert a list of positions to LLA waypoints in one go
+    :param drone: BasicArdu object, its global home is the NED origin
+    :param frame: Frames.LLA or Frames.NED
+    :param points: list of [x, y, z] or [x, y, z, phi]
+    :return: WaypointArray object
+    '''
+    positions = np.array([point[:3] for point in points], dtype=float).reshape(-1, 3)
+    phi = [float(point[3]) if len(point) > 3 else 0.0 for point in points]
+    if frame.value == Frames.NED.value:
+        positions = drone.home_plane.ned_to_lla(positions)
+    return WaypointArray.from_lla(positions, phi)
+
+
+def fly_mission(drone, waypoints, wait=True):
+    '''
+    Function to fly an autopilot mission with a timeout from its length, so a lost MISSION_ITEM_REACHED does not
+    hold the vehicle lock forever
+    :param drone: BasicArdu object
+    :param waypoints: list of Waypoint objects (LLA, alt msl)
+    :param wait: boolean, block until the last waypoint has been reached
+    :return: True, failures are raised
+    '''
+    generation = drone.movement_generation
+    timeout = drone.mission_timeout(waypoints)
+    if drone.handle_mission(waypoints, wait=wait, timeout=timeout, generation=generation):
+        return True
+    if drone.movement_cancelled(generation):
+        raise RuntimeError('mission cancelled')
+    if not drone.mission_waypoints:
+        raise RuntimeError('mission upload failed')
+    raise TimeoutError('mission not completed within %.0f s' % timeout)
+
+
+def get_state(drone):
+    '''
+    Function to read a snapshot of the vehicle state without sending any commands
+    :param drone: BasicArdu object
+    :return: dictionary of position, mode, armed state and battery
+    '''
+    lat, lon, alt = drone.get_LLA()
+    vehicle = drone.vehicle
+    return {
+        'lat': lat,
+        'lon': lon,
+        'alt': alt,
+        'mode': vehicle.mode.name,
+        'armed': vehicle.armed,
+        'battery_voltage': vehicle.battery.voltage if vehicle.battery else None,
+        'battery_level': vehicle.battery.level if vehicle.battery else None,
+    }
+
+
+class DaemonRequestHandler(socketserver.StreamRequestHandler):
+    '''
+    Reads one JSON request per line and writes one JSON reply per line
+    '''
+    def handle(self):
+        for line in self.rfile:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                request = json.loads(line.decode('utf-8'))
+                reply = self.server.drone_daemon.handle_command(request)
+            except ValueError as e:
+                reply = {'success': False, 'error': 'bad request: %s' % e}
+            self.wfile.write((json.dumps(reply) + '\n').encode('utf-8'))
+            self.wfile.flush()
+
+
+class DaemonServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, address, daemon):
+        socketserver.ThreadingTCPServer.__init__(self, address, DaemonRequestHandler)
+        self.drone_daemon = daemon
+
+
+def send_command(command, args=None, vehicle=None, host='127.0.0.1', port=8765):
+    '''
+    Function to send one command to a running daemon and wait for its reply
+    :param command: string command name
+    :param args: dictionary of command arguments
+    :param vehicle: string vehicle name (default vehicle if None)
+    :return: dictionary reply
+    '''
+    request = {'command': command, 'args': args or {}, 'vehicle': vehicle}
+    with socket.create_connection((host, port)) as sock:
+        sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        reply = sock.makefile('rb').readline()
+    return json.loads(reply.decode('utf-8'))
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--vehicle', action='append', default=None, help='name=connection_string, may be repeated (default drone1=tcp:127.0.0.1:5762)')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='address to listen on')
+    parser.add_argument('--port', type=int, default=8765, help='port to listen on')
+    parser.add_argument('--verbose', action='store_true', help='extra text outputs')
+    options = parser.parse_args()
+
+    vehicles = {}
+    for entry in options.vehicle or ['drone1=tcp:127.0.0.1:5762']:
+        name, connection_string = entry.split('=', 1)
+        vehicles[name] = connection_string
+
+    daemon = DroneDaemon(vehicles, verbose=options.verbose)
+    server = DaemonServer((options.host, options.port), daemon)
+    print('Drone daemon listening on %s:%s' % (options.host, options.port))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+    server.server_close()
+    daemon.close()
+    print('Drone daemon stopped.')
+
+
+if __name__ == '__main__':
+    main()
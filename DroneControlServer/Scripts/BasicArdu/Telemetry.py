@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+
+'''
+Telemetry fan-out for the control server. One set of dronekit attribute listeners per
+vehicle feeds any number of subscribers (e.g. browsers on the /stream endpoint), so the
+number of viewers does not change the load on the MAVLink link.
+'''
+from threading import Lock
+from time import time
+import queue
+
+
+# dronekit attributes pushed to subscribers
+TELEMETRY_ATTRIBUTES = ('location.global_frame', 'mode', 'armed', 'battery')
+
+
+class TelemetryHub():
+    def __init__(self, vehicle, name, max_queue=100):
+        '''
+        Listens to a vehicle and pushes state snapshots to every subscriber queue
+        :param vehicle: dronekit vehicle object
+        :param name: string vehicle name included in every update
+        :param max_queue: integer number of updates buffered per subscriber before the oldest is dropped
+        '''
+        self.vehicle = vehicle
+        self.name = name
+        self.max_queue = max_queue
+        self.subscribers = []
+        self.lock = Lock()
+        self.state = {'vehicle': name, 'time': time(), 'lat': None, 'lon': None, 'alt': None,
+                      'mode': None, 'armed': None, 'battery_voltage': None, 'battery_level': None}
+
+        for attr_name in TELEMETRY_ATTRIBUTES:
+            self.vehicle.add_attribute_listener(attr_name, self.attribute_callback)
+
+    def close(self):
+        '''
+        Method to remove the vehicle listeners
+        '''
+        for attr_name in TELEMETRY_ATTRIBUTES:
+            self.vehicle.remove_attribute_listener(attr_name, self.attribute_callback)
+
+    def subscribe(self, subscriber=None):
+        '''
+        Method to register a subscriber
+        :param subscriber: queue.Queue to push updates to, a new one is made if None (lets one queue follow several vehicles)
+        :return: the subscriber queue, primed with the latest state
+        '''
+        if subscriber is None:
+            subscriber = queue.Queue(maxsize=self.max_queue)
+        with self.lock:
+            self.subscribers.append(subscriber)
+            self.offer(subscriber, dict(self.state))
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+
+    def attribute_callback(self, vehicle, attr_name, value):
+        '''
+        dronekit listener, updates the state and fans it out to all subscribers
+        '''
+        with self.lock:
+            if attr_name == 'location.global_frame':
+                self.state['lat'], self.state['lon'], self.state['alt'] = value.lat, value.lon, value.alt
+            elif attr_name == 'mode':
+                self.state['mode'] = value.name
+            elif attr_name == 'armed':
+                self.state['armed'] = value
+            elif attr_name == 'battery':
+                self.state['battery_voltage'], self.state['battery_level'] = value.voltage, value.level
+            self.state['time'] = time()
+
+            update = dict(self.state)
+            for subscriber in self.subscribers:
+                self.offer(subscriber, update)
+
+    def offer(self, subscriber, update):
+        '''
+        Method to queue an update without blocking the listener thread; a slow subscriber loses its oldest update
+        '''
+        while True:
+            try:
+                subscriber.put_nowait(update)
+                return
+            except queue.Full:
+                try:
+                    subscriber.get_nowait()
+                except queue.Empty:
+                    pass
@@ -13,13 +13,14 @@
 ### Debug flags ----------
 debug_comm = False
 debug_flight = False
+virtual_clock = False	# Run the debug cycle on a discrete-event clock, so simulated waits take no real time.
 verbose = False
 
 
 ### Imports ----------
 
 ## Unconditional imports.
-from collections import OrderedDict
+from collections import OrderedDict , deque
 import csv
 import datetime
 from enum import Enum , unique #, auto
@@ -29,7 +30,7 @@ import os
 import struct
 import sys
 import threading
-from time import sleep
+import time
 
 
 ## Conditional imports.
@@ -37,6 +38,9 @@ if not debug_comm:
 	from tinyos3 import tos
 if not debug_flight:
 	from BasicArducopter.BasicArdu.BasicArdu import BasicArdu, Frames
+	from BasicArducopter.tools.CommonStructs import MissionTransform , TangentPlane
+if virtual_clock:
+	from BasicArducopter.tools.Clock import VirtualClock
 
 ### Global variables and constants ----------
 
@@ -44,7 +48,9 @@ if not debug_flight:
 serial_port_numbers = [ i for i in range( 10 ) ]		# Port numbers to check for serial connection to MagoNode++.
 SN_IDs = [ 2 , 3 , 4 , 5 , 6 , 7 , 8 , 9 , 10 , 11 ]	# Shortened IDs for deployed sensor nodes.
 max_number_of_attempts = 25						# The maximum number of times that a node will try to send a message.
-milliseconds_between_attempts = 40					# The number of milliseconds between consecutive attempts to send a message. Must be greater than or equal to 25.
+milliseconds_between_attempts = 40					# The number of milliseconds between consecutive attempts to send a message before a node's round trip time has been measured. Must be greater than or equal to 25.
+maximum_milliseconds_between_attempts = 400			# The most that retries to an unresponsive node are backed off to, in milliseconds. A node is given up on after max_number_of_attempts or max_number_of_attempts * milliseconds_between_attempts, whichever comes first.
+collection_window = 3								# The maximum number of sensor nodes with a data request outstanding at once. 1 collects from one node at a time.
 scenario_WuR = True								# Experiment scenario flag: if true, then the SNs respond to WuSs; if false, then the SNs duty cycle and respond to CTSs.
 DC_cycle_period_in_milliseconds = 1000				# Duty cycle net duration (awake and asleep). Must be greater than 25.
 DC_awake_period_in_milliseconds = 1000				# Duty cycle awake duration. Must be greater than or equal to 0, and less than or equal to DC_cycle_period_in_milliseconds.
@@ -87,13 +93,32 @@ assert 50 <= DC_cycle_period_in_milliseconds
 assert 0 <= DC_awake_period_in_milliseconds <= DC_cycle_period_in_milliseconds
 assert 25 < milliseconds_between_attempts
 assert 1 <= flight_altitude_in_metres
+assert milliseconds_between_attempts <= maximum_milliseconds_between_attempts
+assert 1 <= collection_window
+assert not virtual_clock or ( debug_comm and debug_flight )	# The virtual clock only advances while waiting, so it cannot time real hardware.
+
+## Wall clock, with the same interface as the VirtualClock used in its place when virtual_clock is set.
+class Wall_Clock:
+
+	def time( self ):
+		return time.time()
+
+	def now( self ):
+		return datetime.datetime.fromtimestamp( self.time() )
+
+	def sleep( self , seconds ):
+		if seconds > 0:
+			time.sleep( seconds )
 
 ## Variables (must not be altered, may change during runtime).
+clock = VirtualClock() if virtual_clock else Wall_Clock()	# Clock used for all waiting and timing in the collection cycle.
 collection_cycle_start_time = None
 collection_cycle_end_time = None
 latencies = [ list() for _ in range( len( SN_IDs ) ) ]
 awake_durations = [ None for _ in range( len( SN_IDs ) ) ]
 go_to_next_waypoint = True
+RTT_estimators = dict()	# ( SN_ID , reply packet type ) -> RTT_Estimator, kept across the collection points of a cycle.
+wake_phase_estimators = dict()	# SN_ID -> Wake_Phase_Estimator, kept across the collection points of a cycle (DC scenario only).
 
 
 ### Utility functions ----------
@@ -168,32 +193,87 @@ def generate_square_spiral_path( layers = 2 , origin = [ 0 , 0 ] ):
 
 	return path_waypoints
 
-def scale_waypoints_by_factor( path_waypoints , scaling_factor = 1 , origin = [ 0 , 0 ] ):
-	new_path_waypoints = [ [ None , None ] for _ in range( len( path_waypoints ) ) ]
-	for i in range( len( path_waypoints ) ):
-		new_path_waypoints[ i ][ 0 ] = ( scaling_factor * ( path_waypoints[ i ][ 0 ] - origin[ 0 ] ) ) + origin[ 0 ]
-		new_path_waypoints[ i ][ 1 ] = ( scaling_factor * ( path_waypoints[ i ][ 1 ] - origin[ 1 ] ) ) + origin[ 1 ]
-	return new_path_waypoints
 
-def scale_waypoints_to_point( path_waypoints , orienting_point = [ 0 , 1 ] , origin = [ 0 , 0 ] ):
-	new_path_waypoints = [ [ None , None ] for _ in range( len( path_waypoints ) ) ]
-	scaling_factor = math.sqrt( ( ( orienting_point[ 0 ] - origin[ 0 ] ) ** 2 ) + ( ( orienting_point[ 1 ] - origin[ 1 ] ) ** 2 ) )
-	return scale_waypoints_by_factor( path_waypoints , scaling_factor , origin )
-
-def rotate_waypoints_by_angle( path_waypoints , angle = 0 , origin = [ 0 , 0 ] ):
-	new_path_waypoints = [ [ None , None ] for _ in range( len( path_waypoints ) ) ]
-	for i in range( len( path_waypoints ) ):
-		new_path_waypoints[ i ][ 0 ] = origin[ 0 ] + ( math.cos( -angle ) * ( path_waypoints[ i ][ 0 ] - origin[ 0 ] ) ) - ( math.sin( -angle ) * ( path_waypoints[ i ][ 1 ] - origin[ 1 ] ) )
-		new_path_waypoints[ i ][ 1 ] = origin[ 1 ] + ( math.sin( -angle ) * ( path_waypoints[ i ][ 0 ] - origin[ 0 ] ) ) + ( math.cos( -angle ) * ( path_waypoints[ i ][ 1 ] - origin[ 1 ] ) )
-	return new_path_waypoints
-
-def rotate_waypoints_to_point( path_waypoints , orienting_point = [ 0 , 1 ] , origin = [ 0 , 0 ] ):
-	new_path_waypoints = [ [ None , None ] for _ in range( len( path_waypoints ) ) ]
-	angle = math.atan2( orienting_point[ 0 ] - origin[ 0 ] , orienting_point[ 1 ] - origin[ 1 ] )
-	return rotate_waypoints_by_angle( path_waypoints , angle , origin )
+### Communication functions ----------
 
+## Wraps the active message controller with a thread that continuously reads the serial port and routes every received packet to a queue per ( source , packet_type ).
+## Callers block on those queues with a timeout instead of polling the serial port, and packets that arrive while they are busy elsewhere are kept.
+class Serial_AM_Dispatcher:
+
+	def __init__( self , active_message_controller , read_timeout = 0.005 , queue_length = 64 ):
+		self.active_message_controller = active_message_controller
+		self.read_timeout = read_timeout	# Seconds each serial read blocks for, the reader thread sleeps in the serial driver meanwhile. A write waits for at most one read.
+		self.queue_length = queue_length	# Oldest packets are dropped from a queue nobody is reading.
+		self.queues = dict()
+		self.condition = threading.Condition()
+		self.serial_lock = threading.Lock()	# tos.AM reads its acknowledgements from the serial port inside write, so reads and writes must not overlap.
+		self.writes_waiting = 0
+		self.running = False
+		self.thread = None
+		active_message_controller.setOobHook( self.route_message )	# Every packet tos.AM receives, including those that arrive while it waits for an acknowledgement, comes through here.
+
+	def start( self ):
+		self.running = True
+		self.thread = threading.Thread( target = self.run , daemon = True )
+		self.thread.start()
+
+	def stop( self ):
+		self.running = False
+		if self.thread:
+			self.thread.join()
+
+	def run( self ):
+		while self.running:
+			if self.writes_waiting:
+				time.sleep( 0.001 )	# Let the pending write take the serial port.
+				continue
+			with self.serial_lock:
+				try:
+					self.active_message_controller.read( timeout = self.read_timeout )
+				except Exception as e:
+					if verbose:
+						print( get_EST() , '|' , 'Error: failed to read from the serial port.' , e , flush = True )
 
-### Communication functions ----------
+	def route_message( self , received_message ):
+		received_message = tos.printfHook( received_message )
+		if received_message:
+			try:
+				received_packet = Serial_AM_Packet( received_message.data )
+			except Exception as e:
+				if verbose:
+					print( get_EST() , '|' , 'Error: failed to decode a serial packet.' , e , flush = True )
+				return None
+			with self.condition:
+				key = ( received_packet.source , received_packet.packet_type )
+				if key not in self.queues:
+					self.queues[ key ] = deque( maxlen = self.queue_length )
+				self.queues[ key ].append( received_packet )
+				self.condition.notify_all()
+		return None	# Packets are only delivered through the queues.
+
+	def write( self , packet , amId ):
+		self.writes_waiting += 1
+		try:
+			with self.serial_lock:
+				return self.active_message_controller.write( packet = packet , amId = amId )
+		finally:
+			self.writes_waiting -= 1
+
+	## Wait until a packet is queued for any of the ( source , packet_type ) keys, or the timeout (in seconds) has passed.
+	## Returns ( key , packet ), or ( None , None ) after a timeout.
+	def wait_for_packet( self , keys , timeout ):
+		with self.condition:
+			key = self.condition.wait_for( lambda: next( ( key for key in keys if self.queues.get( key ) ) , None ) , max( timeout , 0 ) )
+			if key == None:
+				return None , None
+			return key , self.queues[ key ].popleft()
+
+	## Discard queued packets for the ( source , packet_type ) keys, so stale replies to earlier requests are not taken for new ones.
+	def clear( self , keys ):
+		with self.condition:
+			for key in keys:
+				if key in self.queues:
+					self.queues[ key ].clear()
 
 ## Initialise the serial port.
 def initialise_serial_port():
@@ -281,111 +361,280 @@ def send_scenario_packet( active_message_controller , destination_SN , scenario_
 	else:
 		print( get_EST() , '|' , 'Error: Invalid active message controller specified.' , flush = True )
 
-## Receive a serial message and extract its packet.
-def receive_serial_packet( active_message_controller ):
-	received_message = None
+## Wait up to timeout seconds for a packet of the given type from the given source.
+def receive_serial_packet( active_message_controller , source , packet_type , timeout ):
 	received_packet = None
 	if active_message_controller != None:
-		try:
-			received_message = active_message_controller.read( timeout = 0.001 ) # Timeout set to prevent blocking.
-		except:
-			pass
-		if received_message:
-			received_packet = Serial_AM_Packet( received_message.data )
+		_ , received_packet = active_message_controller.wait_for_packet( [ ( source , packet_type ) ] , timeout )
 	else:
 		print( '\n' + 'Error: Invalid active message controller specified.' + '\n' , flush = True )
 	return received_packet
 
-## The MDC_Sniffer either:
-## * Sends a packet to the MDC_WuR, which broadcasts a WuS, which tells the SN_WuR to send back a data packet.
-## * Sends a packet to the SN_WuR, which tells the SN_WuR to send back a data packet.
-def collect_data_from_node( active_message_controller , SN_ID ):
+## Round trip time estimate for one kind of exchange with one node, which sets the time to wait before retrying (smoothed RTT and RTT variance, as TCP does).
+## Only replies to requests that were sent once are measured, a reply after a retry could belong to either request (Karn's rule).
+## Each retry doubles the wait (exponential backoff) up to maximum_timeout, until a new measurement resets it.
+class RTT_Estimator:
+
+	def __init__( self , initial_timeout , minimum_timeout = 0.025 , maximum_timeout = 0.8 ):
+		self.smoothed_RTT = None
+		self.RTT_variance = None
+		self.retransmission_timeout = initial_timeout
+		self.minimum_timeout = minimum_timeout
+		self.maximum_timeout = maximum_timeout
+		self.backoff = 1
+
+	## Seconds to wait for a reply before retrying.
+	def timeout( self ):
+		return min( self.retransmission_timeout * self.backoff , self.maximum_timeout )
+
+	def add_sample( self , RTT ):
+		if self.smoothed_RTT == None:
+			self.smoothed_RTT = RTT
+			self.RTT_variance = RTT / 2
+		else:
+			self.RTT_variance = ( 0.75 * self.RTT_variance ) + ( 0.25 * abs( self.smoothed_RTT - RTT ) )
+			self.smoothed_RTT = ( 0.875 * self.smoothed_RTT ) + ( 0.125 * RTT )
+		self.retransmission_timeout = min( max( self.smoothed_RTT + ( 4 * self.RTT_variance ) , self.minimum_timeout ) , self.maximum_timeout )
+		self.backoff = 1
+
+	def add_timeout( self ):
+		if self.retransmission_timeout * self.backoff < self.maximum_timeout:
+			self.backoff *= 2
+
+## Get the round trip time estimate for replies of reply_type from SN_ID, starting from milliseconds_between_attempts.
+def get_RTT_estimator( SN_ID , reply_type ):
+	key = ( SN_ID , reply_type )
+	if key not in RTT_estimators:
+		maximum_timeout = maximum_milliseconds_between_attempts / 1000.0
+		if ( reply_type == PacketTypes.DATA.value ) and not scenario_WuR:
+			maximum_timeout = max( min( maximum_timeout , DC_awake_period_in_milliseconds / 1000.0 ) , 0.025 )	# Retrying less often than the node is awake could miss its awake period.
+		RTT_estimators[ key ] = RTT_Estimator( min( milliseconds_between_attempts / 1000.0 , maximum_timeout ) , 0.025 , maximum_timeout )
+	return RTT_estimators[ key ]
+
+## Estimate of when a duty cycling node is awake, learnt from the times it replied (SET_SCENARIO acknowledgements and data packets).
+## A reply means the node was awake when it received the request, so its awake period started at most awake_period before then.
+## The possible start times from every reply are intersected (modulo the cycle period), and requests are then only sent while the node could be awake.
+class Wake_Phase_Estimator:
+
+	def __init__( self , cycle_period , awake_period ):
+		self.cycle_period = cycle_period
+		self.awake_period = awake_period
+		self.earliest_start = None	# Earliest and latest time that one of the node's awake periods could have started.
+		self.latest_start = None
+		self.missed_spans = 0
+
+	def reset( self ):
+		self.earliest_start = None
+		self.latest_start = None
+		self.missed_spans = 0
+
+	## Called when requests sent in a predicted awake span got no reply. One miss can be packet loss, a second in a row means the prediction is wrong.
+	def add_missed_span( self ):
+		self.missed_spans += 1
+		if self.missed_spans >= 2:
+			self.reset()
+
+	def add_awake_time( self , awake_time ):
+		earliest_start , latest_start = awake_time - self.awake_period , awake_time
+		if self.earliest_start != None:
+			cycles = round( ( earliest_start - self.earliest_start ) / self.cycle_period )
+			earliest_start = max( earliest_start , self.earliest_start + ( cycles * self.cycle_period ) )
+			latest_start = min( latest_start , self.latest_start + ( cycles * self.cycle_period ) )
+			if earliest_start > latest_start:	# Inconsistent with earlier replies (the node's clock drifted or it restarted), so start again from this one.
+				earliest_start , latest_start = awake_time - self.awake_period , awake_time
+		self.earliest_start = earliest_start
+		self.latest_start = latest_start
+		self.missed_spans = 0
+
+	## Returns ( start , end ) of the next time span, ending after time_now, in which the node could be awake, or None if nothing is known yet.
+	def next_awake_span( self , time_now ):
+		if ( self.earliest_start == None ) or ( self.latest_start - self.earliest_start + self.awake_period >= self.cycle_period ):
+			return None
+		cycles = math.ceil( ( time_now - ( self.latest_start + self.awake_period ) ) / self.cycle_period )
+		return self.earliest_start + ( cycles * self.cycle_period ) , self.latest_start + self.awake_period + ( cycles * self.cycle_period )
+
+def get_wake_phase_estimator( SN_ID ):
+	if SN_ID not in wake_phase_estimators:
+		wake_phase_estimators[ SN_ID ] = Wake_Phase_Estimator( DC_cycle_period_in_milliseconds / 1000.0 , DC_awake_period_in_milliseconds / 1000.0 )
+	return wake_phase_estimators[ SN_ID ]
+
+## Exchange a request and reply with several nodes at once.
+## Up to window nodes have a request outstanding at a time, replies are matched to nodes by their source, and each node is retried on its own until it replies or runs out of attempts.
+## Returns an ordered dictionary of SN_ID -> ( reply packet , number of attempts , seconds from the first request to the reply ), the packet and seconds are None for nodes that did not reply.
+## Nodes not yet started when stop_requested() becomes true are left out.
+## With learn_wake_phases, reply times update the nodes' Wake_Phase_Estimators. With wait_for_wake as well, requests are held back until a node could be awake,
+## and the time spent waiting (up to one cycle period) does not count towards giving up. Every node is then started at once, and window limits how many have a request in flight;
+## a node held back for a free request slot keeps its attempts, its time to give up is put back by the time it was held, and its seconds to a reply count from its first request.
+def exchange_with_nodes( active_message_controller , node_IDs , send_request , reply_type , window , stop_requested = None , learn_wake_phases = False , wait_for_wake = False ):
 
 	# Declare/initialise variable(s).
-	success = False
-	attempt_counter = 0
-	loop = True
+	results = OrderedDict()
+	waiting = list( node_IDs )
+	outstanding = OrderedDict()	# SN_ID -> dictionary of attempt counter, first request time, next attempt time, last request time, give up time and the awake span being requested in.
+	active_message_controller.clear( [ ( SN_ID , reply_type ) for SN_ID in node_IDs ] )
 
 	# Start the communication loop.
-	attempt_start_time = datetime.datetime.now()
-	while loop and ( active_message_controller != None ):
-
-		# Get timing variables.
-		current_time = datetime.datetime.now()
-		seconds_since_last_attempt = ( current_time - attempt_start_time ).total_seconds()
-
-		# Request data packet.
-		if ( attempt_counter < 1 ) or ( seconds_since_last_attempt > ( milliseconds_between_attempts / 1000.0 ) ):
-			attempt_start_time = current_time
-			seconds_since_last_attempt = 0
-			if attempt_counter < max_number_of_attempts:
-				attempt_counter += 1
-				send_request_for_data_packet( active_message_controller , SN_ID )
+	while waiting or outstanding:
+
+		# Start requests to waiting nodes while the window has room.
+		while waiting and ( ( len( outstanding ) < window ) or wait_for_wake ) and not ( stop_requested and stop_requested() ):
+			outstanding[ waiting.pop( 0 ) ] = {
+				'attempts' : 0
+				, 'start_time' : clock.time()
+				, 'next_attempt_time' : clock.time()
+				, 'request_time' : None
+				, 'waiting_for_reply' : False
+				, 'give_up_time' : clock.time() + ( max_number_of_attempts * milliseconds_between_attempts / 1000.0 )
+				, 'wait_allowed' : DC_cycle_period_in_milliseconds / 1000.0
+				, 'awake_span' : None
+				, 'sent_in_span' : False
+				, 'held_since' : None	# Time the node started waiting for a free request slot.
+			}
+		if stop_requested and stop_requested():
+			waiting = []
+
+		# Send every request that is due, giving up on nodes that are out of attempts.
+		for SN_ID in list( outstanding ):
+			attempt = outstanding[ SN_ID ]
+			if clock.time() < attempt[ 'next_attempt_time' ]:
+				continue
+			RTT_estimator = get_RTT_estimator( SN_ID , reply_type )
+			if attempt[ 'waiting_for_reply' ]:
+				RTT_estimator.add_timeout()
+				attempt[ 'waiting_for_reply' ] = False
+
+			# Hold the request back until the node could be awake.
+			if wait_for_wake:
+				wake_phase_estimator = get_wake_phase_estimator( SN_ID )
+				if ( attempt[ 'awake_span' ] != None ) and ( clock.time() >= attempt[ 'awake_span' ][ 1 ] ):
+					if attempt[ 'sent_in_span' ]:
+						wake_phase_estimator.add_missed_span()
+					attempt[ 'sent_in_span' ] = False
+				one_way_time = ( RTT_estimator.smoothed_RTT or 0 ) / 2
+				attempt[ 'awake_span' ] = wake_phase_estimator.next_awake_span( clock.time() + one_way_time )
+				if attempt[ 'awake_span' ] != None:
+					wait = min( attempt[ 'awake_span' ][ 0 ] - one_way_time - clock.time() , attempt[ 'wait_allowed' ] )
+					if wait > 0:
+						attempt[ 'next_attempt_time' ] = clock.time() + wait
+						attempt[ 'give_up_time' ] += wait
+						attempt[ 'wait_allowed' ] -= wait
+						continue
+
+			if wait_for_wake and ( sum( other[ 'waiting_for_reply' ] for other in outstanding.values() ) >= window ):
+				attempt[ 'next_attempt_time' ] = min( other[ 'next_attempt_time' ] for other in outstanding.values() if other[ 'waiting_for_reply' ] )
+				if attempt[ 'held_since' ] == None:
+					attempt[ 'held_since' ] = clock.time()
+				continue	# Sent when a request in flight is answered or times out.
+			if attempt[ 'held_since' ] != None:
+				attempt[ 'give_up_time' ] += clock.time() - attempt[ 'held_since' ]	# Time spent held does not use up the node's attempts.
+				attempt[ 'held_since' ] = None
+			if attempt[ 'attempts' ] == 0:
+				attempt[ 'start_time' ] = clock.time()
+				attempt[ 'give_up_time' ] = clock.time() + ( max_number_of_attempts * milliseconds_between_attempts / 1000.0 )
+			if ( attempt[ 'attempts' ] < max_number_of_attempts ) and ( clock.time() < attempt[ 'give_up_time' ] ):
+				send_request( active_message_controller , SN_ID )
+				attempt[ 'attempts' ] += 1
+				attempt[ 'request_time' ] = clock.time()	# Once the sniffer has acknowledged the request over serial.
+				attempt[ 'waiting_for_reply' ] = True
+				attempt[ 'sent_in_span' ] = attempt[ 'awake_span' ] != None
+				attempt[ 'next_attempt_time' ] = min( attempt[ 'request_time' ] + RTT_estimator.timeout() , attempt[ 'give_up_time' ] )
 			else:
-				loop = False
-				if verbose:
-					print( get_EST() , '|' , 'Data collection failed for node' , SN_ID , 'after' , attempt_counter , 'attempt(s).' , flush = True )
-
-		# Receive serial packet.
-		received_packet = receive_serial_packet( active_message_controller )
+				results[ SN_ID ] = ( None , attempt[ 'attempts' ] , None )
+				del outstanding[ SN_ID ]
+		if not outstanding:
+			continue
+
+		# Wait for a reply from any outstanding node until the next request is due.
+		next_attempt_time = min( attempt[ 'next_attempt_time' ] for attempt in outstanding.values() )
+		key , received_packet = active_message_controller.wait_for_packet( [ ( SN_ID , reply_type ) for SN_ID in outstanding ] , next_attempt_time - clock.time() )
 		if received_packet != None:
-			# Process received packet.
-			#print( 'Packet received: ' + str( received_packet ) , flush = True )
-			if received_packet.packet_type == PacketTypes.DATA.value and received_packet.source == SN_ID:
-				print( get_EST() , '|' , 'Data packet successfully received from node' , received_packet.source , 'after' , attempt_counter , 'attempt(s).' , flush = True )
-				success = True
-				loop = False
+			SN_ID = key[ 0 ]
+			attempt = outstanding.pop( SN_ID )
+			RTT_estimator = get_RTT_estimator( SN_ID , reply_type )
+			if attempt[ 'attempts' ] == 1:
+				RTT_estimator.add_sample( clock.time() - attempt[ 'request_time' ] )
+			if learn_wake_phases:
+				get_wake_phase_estimator( SN_ID ).add_awake_time( clock.time() - ( ( RTT_estimator.smoothed_RTT or ( clock.time() - attempt[ 'request_time' ] ) ) / 2 ) )
+			results[ SN_ID ] = ( received_packet , attempt[ 'attempts' ] , clock.time() - attempt[ 'start_time' ] )
+			for other in outstanding.values():
+				if other[ 'held_since' ] != None:
+					other[ 'next_attempt_time' ] = clock.time()	# A request slot is free.
 
 	# Return.
-	return success
+	return results
 
-## The MDC_Sniffer sends a packet to the SN_WuR, which sets the specified scenario parameters, then returns an acknowlegement.
-def set_scenario( active_message_controller , SN_ID , scenario_type ):
-
-	# Declare/initialise variable(s).
-	output = None if scenario_type == ScenarioTypes.SCENARIO_OFF.value else False
-	attempt_counter = 0
-	loop = True
-
-	# Start the communication loop.
-	attempt_start_time = datetime.datetime.now()
-	while loop and ( active_message_controller != None ):
-
-		# Get timing variables.
-		current_time = datetime.datetime.now()
-		seconds_since_last_attempt = ( current_time - attempt_start_time ).total_seconds()
-
-		# Request data packet.
-		if ( attempt_counter < 1 ) or ( seconds_since_last_attempt > ( milliseconds_between_attempts / 1000.0 ) ):
-			attempt_start_time = current_time
-			seconds_since_last_attempt = 0
-			if attempt_counter < max_number_of_attempts:
-				attempt_counter += 1
-				send_scenario_packet( active_message_controller , SN_ID , scenario_type )
-			else:
-				loop = False
-				if verbose:
-					print( get_EST() , '|' , 'Scenario setting failed for node' , SN_ID , 'after' , attempt_counter , 'attempt(s).' , flush = True )
+## The MDC_Sniffer either:
+## * Sends packets to the MDC_WuR, which broadcasts WuSs, which tell the SN_WuRs to send back data packets.
+## * Sends packets to the SN_WuRs, which tell the SN_WuRs to send back data packets.
+## Up to window nodes are collected from at once. Returns an ordered dictionary of SN_ID -> seconds taken to collect, or None if collection failed.
+def collect_data_from_nodes( active_message_controller , node_IDs , window = collection_window , stop_requested = None ):
+	latencies_by_SN = OrderedDict()
+	if active_message_controller == None:
+		return latencies_by_SN
+	results = exchange_with_nodes( active_message_controller , node_IDs , send_request_for_data_packet , PacketTypes.DATA.value , window , stop_requested , not scenario_WuR , not scenario_WuR )
+	for SN_ID , ( received_packet , attempt_counter , latency ) in results.items():
+		if received_packet != None:
+			print( get_EST() , '|' , 'Data packet successfully received from node' , SN_ID , 'after' , attempt_counter , 'attempt(s).' , flush = True )
+		elif verbose:
+			print( get_EST() , '|' , 'Data collection failed for node' , SN_ID , 'after' , attempt_counter , 'attempt(s).' , flush = True )
+		latencies_by_SN[ SN_ID ] = latency
+	return latencies_by_SN
 
-		# Receive serial packet.
-		received_packet = receive_serial_packet( active_message_controller )
+## Collect data from a single node, returns True on success.
+def collect_data_from_node( active_message_controller , SN_ID ):
+	return collect_data_from_nodes( active_message_controller , [ SN_ID ] , 1 ).get( SN_ID ) != None
+
+## The MDC_Sniffer sends packets to the SN_WuRs, which set the specified scenario parameters, then return acknowlegements.
+## All nodes are sent SET_SCENARIO at once (or up to window at a time) and each is retried on its own until it acknowledges.
+## Returns an ordered dictionary of SN_ID -> dictionary of 'acknowledged' (Boolean), 'ms_awake' (milliseconds awake reported by the acknowledgement, or None), 'attempts', and 'seconds' (from the first SET_SCENARIO to the acknowledgement, or None).
+def set_scenario_of_nodes( active_message_controller , node_IDs , scenario_type , window = None ):
+	scenario_results = OrderedDict()
+	if active_message_controller == None:
+		print( get_EST() , '|' , 'Error: Invalid active message controller specified.' , flush = True )
+		return scenario_results
+	send_request = lambda active_message_controller , SN_ID: send_scenario_packet( active_message_controller , SN_ID , scenario_type )
+	if scenario_type == ScenarioTypes.SCENARIO_DC.value:
+		for SN_ID in node_IDs:
+			get_wake_phase_estimator( SN_ID ).reset()	# The acknowledgement is the first sight of the new duty cycle.
+	results = exchange_with_nodes( active_message_controller , node_IDs , send_request , PacketTypes.ACK_SCENARIO.value , window or len( node_IDs ) , learn_wake_phases = scenario_type == ScenarioTypes.SCENARIO_DC.value )
+	for SN_ID in node_IDs:
+		received_packet , attempt_counter , seconds = results[ SN_ID ]
 		if received_packet != None:
-			# Process received packet.
-			if received_packet.packet_type == PacketTypes.ACK_SCENARIO.value and received_packet.source == SN_ID:
-				print( get_EST() , '|' , 'Scenario acknowledgement successfully received from node' , received_packet.source , 'after' , attempt_counter , 'attempt(s).' , flush = True )
-				if scenario_type == ScenarioTypes.SCENARIO_OFF.value:
-					output = received_packet.ms_awake
-				else:
-					output = True
-				loop = False
+			print( get_EST() , '|' , 'Scenario acknowledgement successfully received from node' , SN_ID , 'after' , attempt_counter , 'attempt(s).' , flush = True )
+		elif verbose:
+			print( get_EST() , '|' , 'Scenario setting failed for node' , SN_ID , 'after' , attempt_counter , 'attempt(s).' , flush = True )
+		scenario_results[ SN_ID ] = {
+			'acknowledged' : received_packet != None
+			, 'ms_awake' : received_packet.ms_awake if received_packet != None else None
+			, 'attempts' : attempt_counter
+			, 'seconds' : seconds
+		}
+	return scenario_results
 
-	# Return.
+## The MDC_Sniffer sends a packet to the SN_WuR, which sets the specified scenario parameters, then returns an acknowlegement.
+## Returns the milliseconds awake (None on failure) for SCENARIO_OFF, otherwise True or False.
+def set_scenario( active_message_controller , SN_ID , scenario_type ):
+	output = None if scenario_type == ScenarioTypes.SCENARIO_OFF.value else False
+	result = set_scenario_of_nodes( active_message_controller , [ SN_ID ] , scenario_type ).get( SN_ID )
+	if result and result[ 'acknowledged' ]:
+		output = result[ 'ms_awake' ] if scenario_type == ScenarioTypes.SCENARIO_OFF.value else True
 	return output
 
+## Set the scenario of every node, or pretend to in communication debug mode.
+def set_scenario_of_all_nodes( active_message_controller , scenario_type ):
+	if not debug_comm:
+		return set_scenario_of_nodes( active_message_controller , SN_IDs , scenario_type )
+	clock.sleep( 0.1 ) # Sleep for 0.1 seconds to represent the time taken for the SNs to acknowledge the scenario.
+	print( get_EST() , '|' , 'Scenario set in communication debug mode.' , flush = True )
+	return OrderedDict( ( SN_ID , { 'acknowledged' : True , 'ms_awake' : None , 'attempts' : 1 , 'seconds' : 0.1 } ) for SN_ID in SN_IDs )
+
 ## Initialise active message controller for serial communications.
 def initialise_comm():
 	serial_port = initialise_serial_port()
 	active_message_controller = initialise_active_message_controller( serial_port )
+	if active_message_controller != None:
+		active_message_controller = Serial_AM_Dispatcher( active_message_controller )
+		active_message_controller.start()
 	return active_message_controller
 
 
@@ -418,7 +667,7 @@ def initialise_collection_cycle():
 	print( get_EST() , '|' , 'Basic drone initialising...' , flush = True )
 	if not debug_flight:
 		try:
-			drone = BasicArdu( frame = Frames.LLA , connection_string = '/dev/ttyACM0' )
+			drone = BasicArdu( frame = Frames.LLA , connection_string = '/dev/ttyACM0' , clock = clock )
 			print( get_EST() , '|' , 'Basic drone initialised.' , flush = True )
 		except Exception as e:
 			print( get_EST() , '|' , 'Error:' , e , flush = True )
@@ -451,6 +700,8 @@ def run_collection_cycle( active_message_controller , drone ):
 	orienting_point = [ 0 , 1 ] # Point in latitude and longitude, used to determine the orientation (namely, the 'front') of the naive path.
 	data_collection_start_time = None
 	data_collection_end_time = None
+	RTT_estimators.clear()
+	wake_phase_estimators.clear()
 
 	# Check parameter validity.
 	if ( active_message_controller or debug_comm ) and ( drone or debug_flight ):
@@ -478,20 +729,22 @@ def run_collection_cycle( active_message_controller , drone ):
 
 		# Determine collection points.
 		print( get_EST() , '|' , 'Generating collection points...' , flush = True )
-		collection_points = generate_square_spiral_path( 1 , origin )
-		collection_points = rotate_waypoints_to_point( collection_points , orienting_point , origin )
-		collection_points = scale_waypoints_to_point( collection_points , orienting_point , origin )
-		collection_points = scale_waypoints_by_factor( collection_points , 1/3 , origin )
+		if debug_flight:
+			collection_points = generate_square_spiral_path( 1 )	# Not flown to, so only the number of points matters.
+		else:
+			# The spiral is laid out in metres north ( x ) and east ( y ) of the base station, turned and scaled to the orienting point in one transform.
+			plane = TangentPlane( origin + [ 0 ] )
+			orienting_north , orienting_east , _ = plane.lla_to_ned( orienting_point + [ 0 ] )
+			transform = MissionTransform().rotate( -math.atan2( orienting_north , orienting_east ) ).scale( math.hypot( orienting_north , orienting_east ) ).scale( 1/3 )
+			collection_points = transform.to_lla( plane , generate_square_spiral_path( 1 ) )[ : , : 2 ].tolist()
 		print( get_EST() , '|' , 'Collection points generated.' , flush = True )
 
 		## Logic for experiment initialisation goes here.
-		collection_cycle_start_time = datetime.datetime.now()
+		collection_cycle_start_time = clock.now()
+		scenario_type = ScenarioTypes.SCENARIO_WUR.value if scenario_WuR else ScenarioTypes.SCENARIO_DC.value
+		scenario_results = set_scenario_of_all_nodes( active_message_controller , scenario_type )
 		for SN_ID in SN_IDs:
-			if scenario_WuR:
-				success = set_scenario( active_message_controller , SN_ID , ScenarioTypes.SCENARIO_WUR.value )
-			else:
-				success = set_scenario( active_message_controller , SN_ID , ScenarioTypes.SCENARIO_DC.value )
-			if not success:
+			if not ( SN_ID in scenario_results and scenario_results[ SN_ID ][ 'acknowledged' ] ):
 				go_to_next_waypoint = False
 
 		# Takeoff.
@@ -504,10 +757,10 @@ def run_collection_cycle( active_message_controller , drone ):
 				print( get_EST() , '|' , 'Error:' , e , flush = True )
 				print( get_EST() , '|' , 'Flight debug mode activated.' , flush = True )
 				debug_flight = True
-				sleep( 1 ) # Sleep for 1 seconds to represent the time taken for the MDC to take off.
+				clock.sleep( 1 ) # Sleep for 1 seconds to represent the time taken for the MDC to take off.
 				print( get_EST() , '|' , 'MDC has taken off in flight debug mode.' , flush = True )
 		else:
-			sleep( 1 ) # Sleep for 1 seconds to represent the time taken for the MDC to take off.
+			clock.sleep( 1 ) # Sleep for 1 seconds to represent the time taken for the MDC to take off.
 			print( get_EST() , '|' , 'MDC has taken off in flight debug mode.' , flush = True )
 
 		# Collect data at collection points.
@@ -528,32 +781,35 @@ def run_collection_cycle( active_message_controller , drone ):
 						#debug_flight = True
 						#print( get_EST() , '|' , 'MDC has reached collection point in flight debug mode.' , flush = True )
 				else:
-					sleep( 1 ) # Sleep for 1 second to represent the time taken for the MDC to fly to the collection point.
+					clock.sleep( 1 ) # Sleep for 1 second to represent the time taken for the MDC to fly to the collection point.
 					print( get_EST() , '|' , 'MDC has reached collection point in flight debug mode.' , flush = True )
 		
 				# Collect data at collection point.
 				print( get_EST() , '|' , 'MDC is collecting data...' , flush = True )
+				latencies_by_SN = OrderedDict()
+				data_collection_start_time = clock.now()
+				if not debug_comm:
+					try:
+						latencies_by_SN = collect_data_from_nodes( active_message_controller , SN_IDs , collection_window , lambda: not go_to_next_waypoint )
+					except Exception as e:
+						print( get_EST() , '|' , 'Error:' , e , flush = True )
+				else:
+					for index_of_SN_ID in range( 0 , len( SN_IDs ) , collection_window ):
+						if go_to_next_waypoint:
+							clock.sleep( 0.1 ) # Sleep for 0.1 seconds to represent the time taken for the MDC to collect data from up to collection_window SNs at once.
+							for SN_ID in SN_IDs[ index_of_SN_ID : index_of_SN_ID + collection_window ]:
+								latencies_by_SN[ SN_ID ] = 0.1
+					print( get_EST() , '|' , 'MDC has collected data in communication debug mode.' , flush = True )
+				data_collection_end_time = clock.now()
 				for index_of_SN_ID in range( len( SN_IDs ) ):
-					if go_to_next_waypoint:
-						SN_ID = SN_IDs[ index_of_SN_ID ]
-						success = False
-						data_collection_start_time = datetime.datetime.now()
-						if not debug_comm:
-							try:
-								success = collect_data_from_node( active_message_controller , SN_ID )
-							except Exception as e:
-								print( get_EST() , '|' , 'Error:' , e , flush = True )
-						else:
-							success = True
-							sleep( 0.1 ) # Sleep for 0.1 seconds to represent the time taken for the MDC to collect data from the SN.
-							print( get_EST() , '|' , 'MDC has collected data in communication debug mode.' , flush = True )
-						data_collection_end_time = datetime.datetime.now()
-						if success and data_collection_start_time and data_collection_end_time:
-							latency = ( data_collection_end_time - data_collection_start_time ).total_seconds()
-							print( get_EST() , '|' , '\tData collected from node' , SN_ID , 'in' , latency , 'seconds.' , flush = True )
-							latencies[ index_of_SN_ID ].append( latency )
-						#else:
-						#	print( get_EST() , '|' , '\tData collection from node' , SN_ID , 'failed.' , flush = True )
+					SN_ID = SN_IDs[ index_of_SN_ID ]
+					latency = latencies_by_SN.get( SN_ID )
+					if latency != None:
+						print( get_EST() , '|' , '\tData collected from node' , SN_ID , 'in' , latency , 'seconds.' , flush = True )
+						latencies[ index_of_SN_ID ].append( latency )
+					#else:
+					#	print( get_EST() , '|' , '\tData collection from node' , SN_ID , 'failed.' , flush = True )
+				print( get_EST() , '|' , 'Time at collection point:' , ( data_collection_end_time - data_collection_start_time ).total_seconds() , 'seconds.' , flush = True )
 
 			if go_to_next_waypoint:
 				print( get_EST() , '|' , 'MDC has collected data.' , flush = True )
@@ -568,7 +824,7 @@ def run_collection_cycle( active_message_controller , drone ):
 				except Exception as e:
 					print( get_EST() , '|' , 'Error:' , e , flush = True )
 			else:
-				sleep( 2 ) # Sleep for 2 seconds to represent the time taken for the MDC to fly to the base station.
+				clock.sleep( 2 ) # Sleep for 2 seconds to represent the time taken for the MDC to fly to the base station.
 				print( get_EST() , '|' , 'MDC has reached base station in flight debug mode.' , flush = True )
 
 		# Land.
@@ -577,12 +833,12 @@ def run_collection_cycle( active_message_controller , drone ):
 			if not debug_flight:
 				try:
 					drone.handle_landing()
-					collection_cycle_end_time = datetime.datetime.now()
+					collection_cycle_end_time = clock.now()
 					print( get_EST() , '|' , 'MDC has landed.' )
 				except Exception as e:
 					print( get_EST() , '|' , 'Error:' , e , flush = True )
 			else:
-				sleep( 1 ) # Sleep for 1 seconds to represent the time taken for the MDC to land.
+				clock.sleep( 1 ) # Sleep for 1 seconds to represent the time taken for the MDC to land.
 				print( get_EST() , '|' , 'MDC has landed in flight debug mode.' , flush = True )
 		else:
 			print( get_EST() , '|' , 'MDC is emergency landing...' )
@@ -593,14 +849,16 @@ def run_collection_cycle( active_message_controller , drone ):
 				except Exception as e:
 					print( get_EST() , '|' , 'Error:' , e , flush = True )
 			else:
-				sleep( 1 ) # Sleep for 1 seconds to represent the time taken for the MDC to land.
+				clock.sleep( 1 ) # Sleep for 1 seconds to represent the time taken for the MDC to land.
 				print( get_EST() , '|' , 'MDC has emergency landed in flight debug mode.' , flush = True )
 
 		## Logic for experiment finalisation goes here.
+		scenario_results = set_scenario_of_all_nodes( active_message_controller , ScenarioTypes.SCENARIO_OFF.value )
 		for index_of_SN_ID in range( len( SN_IDs ) ):
 			SN_ID = SN_IDs[ index_of_SN_ID ]
-			awake_durations[ index_of_SN_ID ] = set_scenario( active_message_controller , SN_ID , ScenarioTypes.SCENARIO_OFF.value )
-		collection_cycle_end_time = datetime.datetime.now()
+			if SN_ID in scenario_results:
+				awake_durations[ index_of_SN_ID ] = scenario_results[ SN_ID ][ 'ms_awake' ]
+		collection_cycle_end_time = clock.now()
 
 
 ## Collate all of the collected data and save it to file.
@@ -711,18 +969,12 @@ if __name__ == '__main__':
 			print( get_EST() , '|' , 'Data collection not possible in communication debug mode.' , flush = True )
 		else:
 			active_message_controller = initialise_comm()
-			for SN_ID in SN_IDs:
-				if scenario_WuR:
-					success = set_scenario( active_message_controller , SN_ID , ScenarioTypes.SCENARIO_WUR.value )
-				else:
-					success = set_scenario( active_message_controller , SN_ID , ScenarioTypes.SCENARIO_DC.value )
+			set_scenario_of_nodes( active_message_controller , SN_IDs , ScenarioTypes.SCENARIO_WUR.value if scenario_WuR else ScenarioTypes.SCENARIO_DC.value )
 			#sleep( 1 )
-			for SN_ID in SN_IDs:
-				print( get_EST() , '|' , 'Collecting data from SN ' + str( SN_ID ) + '...' , flush = True )
-				success = collect_data_from_node( active_message_controller , SN_ID )
-			for index_of_SN_ID in range( len( SN_IDs ) ):
-				SN_ID = SN_IDs[ index_of_SN_ID ]
-				print( 'SN' , SN_ID , 'was awake for' , set_scenario( active_message_controller , SN_ID , ScenarioTypes.SCENARIO_OFF.value ) , 'milliseconds.' )
+			print( get_EST() , '|' , 'Collecting data from SNs' , SN_IDs , '...' , flush = True )
+			collect_data_from_nodes( active_message_controller , SN_IDs , collection_window )
+			for SN_ID , result in set_scenario_of_nodes( active_message_controller , SN_IDs , ScenarioTypes.SCENARIO_OFF.value ).items():
+				print( 'SN' , SN_ID , 'was awake for' , result[ 'ms_awake' ] , 'milliseconds.' )
 	elif user_input == '2':
 		print( 'MDC coordinates:' , get_coordinates() , flush = True )
 	elif user_input == '3':
@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+
+'''
+Benchmarks for the BasicArdu hot paths, run against the in-process simulated vehicle (tools/SimVehicle.py).
+
+init             BasicArdu.__init__ until the vehicle is ready
+takeoff          handle_takeoff
+leg              handle_waypoint per leg: flight time, host overhead and arrival detection lag
+mdcn_cycle       run_collection_cycle of an MDCn script (--mdcn_script) with simulated sensor nodes: cycle time,
+                 collection points collected per node and requests sent to the nodes
+command_latency  daemon socket request until the MAVLink command leaves BasicArdu (real clock)
+geodesy          seconds per distance for each Geodesy mode (scalar call and per point of an array call) and
+                 its largest error against Vincenty, over random point pairs up to --geodesy_range apart
+
+Simulated flights run on a VirtualClock, so '*_sim_s' is how long the flight takes on the vehicle and
+'*_wall_s' is host time. 'leg_host_s' is the host time of a leg without the simulation's own work.
+Results are written as JSON, --baseline compares the means against an earlier results file and exits
+with status 1 if any got slower by more than --tolerance.
+
+python3 run_benchmarks.py --output results.json
+python3 run_benchmarks.py --baseline results.json --tolerance 0.25
+'''
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from threading import Thread
+from time import perf_counter, time
+import importlib.util
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+
+import numpy as np
+
+# Necessary For Package imports (BasicArdu adds the Scripts directory for tools)
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'BasicArdu'))
+
+from BasicArdu import BasicArdu, Frames
+from DroneDaemon import DroneDaemon, DaemonServer, send_command
+from tools.Clock import VirtualClock
+from tools.CommonStructs import GROUND_DISTANCE, GROUND_DISTANCES, Geodesy, TangentPlane
+from tools.SimVehicle import SimVehicle
+
+
+def summarise(samples):
+    '''
+    Function to reduce a list of samples to its distribution
+    :param samples: list of floats
+    :return: dictionary of count, mean, std, min, median, p90 and max
+    '''
+    ordered = sorted(samples)
+    return {
+        'count': len(ordered),
+        'mean': statistics.fmean(ordered),
+        'std': statistics.stdev(ordered) if len(ordered) > 1 else 0.0,
+        'min': ordered[0],
+        'median': statistics.median(ordered),
+        'p90': ordered[min(len(ordered)-1, math.ceil(0.9*len(ordered))-1)],
+        'max': ordered[-1],
+    }
+
+
+class SimTimer():
+    '''
+    Adds up the host time the simulated vehicle spends on its own work (physics, telemetry encoding, command
+    handling), so it can be taken out of the measured host overhead
+    '''
+    def __init__(self, vehicle):
+        self.total = 0.0
+        for name in ('move', 'send_telemetry', 'handle_message'):
+            setattr(vehicle, name, self.timed(getattr(vehicle, name)))
+
+    def timed(self, function):
+        def wrapper(*args):
+            start = perf_counter()
+            try:
+                return function(*args)
+            finally:
+                self.total += perf_counter() - start
+        return wrapper
+
+
+def make_drone(options, clock):
+    vehicle = SimVehicle(link_delay=options.link_delay, clock=clock)
+    drone = BasicArdu(frame=Frames.NED, vehicle=vehicle, home_cache=None, clock=clock,
+                      telemetry_profile=options.telemetry_profile)
+    return drone, vehicle
+
+
+def bench_init(options):
+    samples = {'init_sim_s': [], 'init_wall_s': []}
+    for _ in range(options.repeat):
+        clock = VirtualClock()
+        start, wall = clock.time(), perf_counter()
+        drone, vehicle = make_drone(options, clock)
+        samples['init_sim_s'].append(clock.time() - start)
+        samples['init_wall_s'].append(perf_counter() - wall)
+        vehicle.close()
+    return samples
+
+
+def bench_takeoff(options):
+    samples = {'takeoff_sim_s': [], 'takeoff_wall_s': []}
+    for _ in range(options.repeat):
+        clock = VirtualClock()
+        drone, vehicle = make_drone(options, clock)
+        start, wall = clock.time(), perf_counter()
+        drone.handle_takeoff(options.altitude)
+        samples['takeoff_sim_s'].append(clock.time() - start)
+        samples['takeoff_wall_s'].append(perf_counter() - wall)
+        vehicle.close()
+    return samples
+
+
+def bench_leg(options):
+    '''
+    Flies the legs of a square and times each handle_waypoint call. The arrival lag is from the simulated
+    vehicle coming within tolerance_location of the target to handle_waypoint returning
+    '''
+    samples = {'leg_sim_s': [], 'leg_wall_s': [], 'leg_host_s': [], 'arrival_lag_sim_s': []}
+    clock = VirtualClock()
+    drone, vehicle = make_drone(options, clock)
+    sim_timer = SimTimer(vehicle)
+    drone.handle_takeoff(options.altitude)
+
+    arrival = {'target': None, 'time': None}
+    def watch_arrival():
+        if arrival['target'] and arrival['time'] is None and math.dist(arrival['target'], vehicle.ned) <= drone.tolerance_location:
+            arrival['time'] = clock.time()
+    ticker = clock.call_every(vehicle.physics_period, watch_arrival)
+
+    side = options.leg_length
+    corners = [(side, 0), (side, side), (0, side), (0, 0)]
+    for leg in range(options.repeat):
+        north, east = corners[leg % len(corners)]
+        arrival['target'], arrival['time'] = [north, east, -options.altitude], None
+        start, wall, sim_work = clock.time(), perf_counter(), sim_timer.total
+        drone.handle_waypoint(Frames.NED, north, east, -options.altitude)
+        wall = perf_counter() - wall
+        samples['leg_sim_s'].append(clock.time() - start)
+        samples['leg_wall_s'].append(wall)
+        samples['leg_host_s'].append(wall - (sim_timer.total - sim_work))
+        if arrival['time'] is not None:
+            samples['arrival_lag_sim_s'].append(clock.time() - arrival['time'])
+    ticker.cancel()
+    vehicle.close()
+    return samples
+
+
+class SimSensorNodes():
+    def __init__(self, mdcn, clock, delay=(0.005, 0.03), loss=0.1, seed=0):
+        '''
+        Stands in for the Serial_AM_Dispatcher of an MDCn script, with its sensor nodes simulated on the clock.
+        Each request is lost with probability loss, otherwise the node replies after a random delay. In the DC
+        scenario a node only answers a CTS that arrives in its awake period, which starts when SET_SCENARIO arrives.
+        :param mdcn: MDCn script module, for its packet class and constants
+        :param clock: VirtualClock shared with the simulated vehicle
+        :param delay: (min, max) float seconds from request to reply
+        :param loss: float probability that a request is lost
+        :param seed: int random seed
+        '''
+        self.mdcn = mdcn
+        self.clock = clock
+        self.delay = delay
+        self.loss = loss
+        self.rng = random.Random(seed)
+        self.queues = {}                # (source, packet type) -> list of reply packets
+        self.scenarios = {}             # SN_ID -> (scenario type, time it was set)
+        self.requests = 0
+
+    def write(self, packet, amId):
+        self.requests += 1
+        types = self.mdcn.PacketTypes
+        now = self.clock.time()
+        node, packet_type = packet.WuS, packet.packet_type
+        if self.rng.random() < self.loss:
+            return True
+        arrival = now + self.rng.uniform(*self.delay) / 2
+        scenario, scenario_time = self.scenarios.get(node, (None, now))
+
+        if packet_type == types.SET_SCENARIO.value:
+            ms_awake = self.ms_awake(scenario, arrival - scenario_time)
+            self.scenarios[node] = (packet.scenario_type, arrival)
+            self.reply(node, types.ACK_SCENARIO.value, ms_awake if packet.scenario_type == self.mdcn.ScenarioTypes.SCENARIO_OFF.value else 0)
+        elif packet_type == types.CTS.value and scenario == self.mdcn.ScenarioTypes.SCENARIO_DC.value:
+            if ((arrival - scenario_time) * 1000) % self.mdcn.DC_cycle_period_in_milliseconds < self.mdcn.DC_awake_period_in_milliseconds:
+                self.reply(node, types.DATA.value)
+        elif packet_type == types.WUS.value and scenario == self.mdcn.ScenarioTypes.SCENARIO_WUR.value:
+            self.reply(node, types.DATA.value)
+        return True
+
+    def ms_awake(self, scenario, seconds):
+        if scenario == self.mdcn.ScenarioTypes.SCENARIO_DC.value:
+            return int(seconds * self.mdcn.DC_awake_period_in_milliseconds / self.mdcn.DC_cycle_period_in_milliseconds * 1000)
+        return 0
+
+    def reply(self, node, packet_type, ms_awake=0):
+        packet = self.mdcn.Serial_AM_Packet()
+        packet.source, packet.packet_type, packet.ms_awake = node, packet_type, ms_awake
+        self.clock.call_later(self.rng.uniform(*self.delay), self.queues.setdefault((node, packet_type), []).append, packet)
+
+    def wait_for_packet(self, keys, timeout):
+        find = lambda: next((key for key in keys if self.queues.get(key)), None)
+        key = self.clock.wait_for(None, find, max(timeout, 0))
+        if key is None:
+            return None, None
+        return key, self.queues[key].pop(0)
+
+    def clear(self, keys):
+        for key in keys:
+            self.queues.pop(key, None)
+
+
+def load_mdcn(name):
+    '''
+    Function to load an MDCn script from Tests as a new module, with the Scripts directory importable as the
+    BasicArducopter package it is cloned as. The scripts need tinyos3 installed
+    :param name: string script name without .py (ex: MDCn_p3e1)
+    :return: module
+    '''
+    scripts = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+    if 'BasicArducopter' not in sys.modules and importlib.util.find_spec('BasicArducopter') is None:
+        spec = importlib.util.spec_from_file_location('BasicArducopter', os.path.join(scripts, '__init__.py'), submodule_search_locations=[scripts])
+        sys.modules['BasicArducopter'] = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(sys.modules['BasicArducopter'])
+    spec = importlib.util.spec_from_file_location(name, os.path.join(scripts, 'Tests', name + '.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def bench_mdcn_cycle(options):
+    '''
+    Runs run_collection_cycle of an MDCn script on the simulated vehicle and SimSensorNodes, all on one
+    VirtualClock: set scenario, takeoff, fly and collect at each collection point, return, land, reset scenario
+    '''
+    samples = {'mdcn_cycle_sim_s': [], 'mdcn_cycle_wall_s': [], 'mdcn_collected': [], 'mdcn_requests': []}
+    cwd = os.getcwd()
+    for repeat in range(options.repeat):
+        mdcn = load_mdcn(options.mdcn_script)          # fresh module globals for every cycle
+        clock = VirtualClock()
+        mdcn.clock = clock
+        drone, vehicle = make_drone(options, clock)
+        mdcn.flight_altitude_in_metres = options.altitude
+        nodes = SimSensorNodes(mdcn, clock, loss=options.node_loss, seed=repeat)
+
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)             # the scripts keep the orienting point in the working directory
+            try:
+                # collection points are spaced leg_length apart, facing north
+                mdcn.save_orienting_coordinates(list(drone.home_plane.lla(3 * options.leg_length, 0, 0)[:2]))
+                start, wall = clock.time(), perf_counter()
+                mdcn.run_collection_cycle(nodes, drone)
+            finally:
+                os.chdir(cwd)
+
+        samples['mdcn_cycle_sim_s'].append(clock.time() - start)
+        samples['mdcn_cycle_wall_s'].append(perf_counter() - wall)
+        samples['mdcn_collected'].append(sum(len(latencies) for latencies in mdcn.latencies) / len(mdcn.SN_IDs))
+        samples['mdcn_requests'].append(nodes.requests)
+        vehicle.close()
+    return samples
+
+
+def bench_command_latency(options):
+    '''
+    Sends non-blocking goto requests through the daemon socket protocol (as index.php does) and measures
+    until the SET_POSITION_TARGET message is passed to the vehicle
+    '''
+    samples = {'command_latency_s': []}
+    daemon = DroneDaemon({'drone1': 'sim'})
+    server = DaemonServer(('127.0.0.1', 0), daemon)
+    Thread(target=server.serve_forever, daemon=True).start()
+
+    vehicle = daemon.drones['drone1'].vehicle
+    sent = []
+    send_mavlink = vehicle.send_mavlink
+    def timed_send(message):
+        if message.get_type().startswith('SET_POSITION_TARGET'):
+            sent.append(perf_counter())
+        send_mavlink(message)
+    vehicle.send_mavlink = timed_send
+
+    for index in range(options.repeat):
+        del sent[:]
+        start = perf_counter()
+        send_command('goto', {'frame': 'NED', 'x': index % 5, 'y': 0, 'z': 0, 'wait': False}, port=server.server_address[1])
+        if sent:
+            samples['command_latency_s'].append(sent[0] - start)
+
+    server.shutdown()
+    server.server_close()
+    daemon.close()
+    return samples
+
+
+def bench_geodesy(options):
+    samples = {}
+    rng = np.random.default_rng(0)
+    count = options.geodesy_points
+    plane = TangentPlane([42.3398, -71.0892, 10.0])        # SimVehicle home
+    start = plane.ned_to_lla(np.column_stack([rng.uniform(-1, 1, (count, 2)) * options.geodesy_range, np.zeros(count)]))
+    bearing = rng.uniform(0, 2*math.pi, count)
+    length = rng.uniform(0, options.geodesy_range, count)
+    end = start + plane.ned_to_lla(np.column_stack([length*np.cos(bearing), length*np.sin(bearing), np.zeros(count)])) - plane.ned_to_lla([0, 0, 0])
+    pairs = [tuple(row) for row in np.column_stack([start[:, :2], end[:, :2]])]
+    reference = GROUND_DISTANCES[Geodesy.VINCENTY](start[:, 0], start[:, 1], end[:, 0], end[:, 1])
+
+    for mode in Geodesy:
+        name = mode.value.lower()
+        scalar, array = GROUND_DISTANCE[mode], GROUND_DISTANCES[mode]
+        samples.update({'geodesy_%s_scalar_s' % name: [], 'geodesy_%s_array_s' % name: [], 'geodesy_%s_error_m' % name: []})
+        for _ in range(options.repeat):
+            wall = perf_counter()
+            for lat1, lon1, lat2, lon2 in pairs:
+                scalar(lat1, lon1, lat2, lon2)
+            samples['geodesy_%s_scalar_s' % name].append((perf_counter() - wall) / count)
+
+            wall = perf_counter()
+            result = array(start[:, 0], start[:, 1], end[:, 0], end[:, 1])
+            samples['geodesy_%s_array_s' % name].append((perf_counter() - wall) / count)
+            samples['geodesy_%s_error_m' % name].append(float(np.max(np.abs(result - reference))))
+    return samples
+
+
+BENCHMARKS = {
+    'init': bench_init,
+    'takeoff': bench_takeoff,
+    'leg': bench_leg,
+    'mdcn_cycle': bench_mdcn_cycle,
+    'command_latency': bench_command_latency,
+    'geodesy': bench_geodesy,
+}
+
+
+def compare(results, baseline, tolerance):
+    '''
+    Function to find the metrics whose mean got slower than the baseline by more than the tolerance
+    :return: list of (metric, baseline mean, new mean)
+    '''
+    regressions = []
+    for metric, summary in results.items():
+        old = baseline.get(metric)
+        if old and old['mean'] > 0 and summary['mean'] > old['mean'] * (1 + tolerance):
+            regressions.append((metric, old['mean'], summary['mean']))
+    return regressions
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--benchmarks', type=str, default=','.join(BENCHMARKS), help='comma separated benchmarks to run')
+    parser.add_argument('--repeat', type=int, default=20, help='samples per benchmark')
+    parser.add_argument('--altitude', type=float, default=5.0, help='flight altitude in meters')
+    parser.add_argument('--leg_length', type=float, default=10.0, help='meters per leg / collection point spacing')
+    parser.add_argument('--mdcn_script', type=str, default='MDCn_p3e1', help='MDCn script in Tests run by the mdcn_cycle benchmark')
+    parser.add_argument('--node_loss', type=float, default=0.1, help='probability that a request to a simulated sensor node is lost')
+    parser.add_argument('--link_delay', type=float, default=0.01, help='simulated MAVLink one way delay in seconds')
+    parser.add_argument('--telemetry_profile', type=str, default='mission', help='BasicArdu telemetry profile')
+    parser.add_argument('--geodesy_points', type=int, default=10000, help='point pairs per geodesy sample')
+    parser.add_argument('--geodesy_range', type=float, default=1000.0, help='largest distance in meters between geodesy point pairs')
+    parser.add_argument('--output', type=str, default='benchmark_results.json', help='results file')
+    parser.add_argument('--baseline', type=str, default=None, help='earlier results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed fractional slowdown of a mean before it counts as a regression')
+    options = parser.parse_args()
+
+    results = {}
+    for name in options.benchmarks.split(','):
+        print('Running', name, '...', flush=True)
+        try:
+            with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+                samples = BENCHMARKS[name](options)
+        except ImportError as e:          # mdcn_cycle needs tinyos3
+            print('  skipped:', e)
+            continue
+        for metric, values in samples.items():
+            if values:
+                results[metric] = summarise(values)
+                print('  %-32s mean %10.4g  median %10.4g  p90 %10.4g  max %10.4g' % (
+                    metric, results[metric]['mean'], results[metric]['median'], results[metric]['p90'], results[metric]['max']))
+
+    report = {
+        'time': time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'options': vars(options),
+        'results': results,
+    }
+    with open(options.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print('Results written to', options.output)
+
+    if options.baseline:
+        with open(options.baseline, 'r') as file:
+            baseline = json.load(file)['results']
+        regressions = compare(results, baseline, options.tolerance)
+        for metric, old, new in regressions:
+            print('REGRESSION: %s mean %.6f -> %.6f' % (metric, old, new))
+        if regressions:
+            sys.exit(1)
+        print('No regressions against', options.baseline)
+
+
+if __name__ == '__main__':
+    main()
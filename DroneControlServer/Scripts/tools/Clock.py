@@ -0,0 +1,167 @@
+import datetime
+import heapq
+import itertools
+from threading import Thread, Timer, current_thread
+import time
+
+
+class RealClock():
+    '''
+    Wall clock time, the default everywhere a clock can be passed in
+    '''
+    def time(self):
+        return time.time()
+
+    def now(self):
+        return datetime.datetime.fromtimestamp(self.time())
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def wait_for(self, condition, predicate, timeout=None):
+        '''
+        Method to wait until predicate() is true, the caller must hold condition and notify it on changes
+        :param condition: threading.Condition
+        :param predicate: function returning a Boolean
+        :param timeout: float seconds (None waits forever)
+        :return: the last result of predicate()
+        '''
+        return condition.wait_for(predicate, timeout)
+
+    def wait_event(self, event, timeout=None):
+        '''
+        Method to wait until an Event is set
+        :param event: threading.Event
+        :param timeout: float seconds (None waits forever)
+        :return: Boolean for if the event was set
+        '''
+        return event.wait(timeout)
+
+    def call_later(self, delay, function, *args):
+        '''
+        Method to run function(*args) once after delay seconds, on its own thread
+        :return: handle with a cancel() method
+        '''
+        timer = Timer(delay, function, args=args)
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    def call_every(self, period, function):
+        '''
+        Method to run function() every period seconds on its own thread. Deadlines are absolute, so the rate does
+        not drift with the run time, and an overrun starts a new schedule instead of catching up with a burst
+        :return: handle with a cancel() method
+        '''
+        return PeriodicThread(period, function)
+
+
+class PeriodicThread():
+    def __init__(self, period, function):
+        self.period = period
+        self.function = function
+        self.running = True
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        next_time = time.monotonic()
+        while self.running:
+            self.function()
+            next_time += self.period
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                next_time = time.monotonic()
+
+    def cancel(self):
+        self.running = False
+        if self.thread is not current_thread():
+            self.thread.join()
+
+
+class VirtualClock():
+    def __init__(self, start=None):
+        '''
+        Discrete-event clock for simulations. Time only moves when a caller sleeps or waits, and jumps straight
+        to the next scheduled event, so simulated flights run as fast as the CPU allows. Events run on the
+        thread that is sleeping or waiting, so a simulation should be driven from a single thread.
+        :param start: float time (s since epoch) the clock starts at, defaults to the current time
+        '''
+        self.current_time = time.time() if start is None else start
+        self.events = []            # heap of (due time, order, VirtualEvent)
+        self.order = itertools.count()
+
+    def time(self):
+        return self.current_time
+
+    def now(self):
+        return datetime.datetime.fromtimestamp(self.current_time)
+
+    def sleep(self, seconds):
+        self.run_until(self.current_time + max(seconds, 0.0))
+
+    def wait_for(self, condition, predicate, timeout=None):
+        '''
+        Method to run events until predicate() is true or the timeout has passed, same arguments as RealClock.wait_for.
+        With no timeout, gives up once there are no events left that could change the result
+        '''
+        deadline = None if timeout is None else self.current_time + timeout
+        result = predicate()
+        while not result:
+            if not self.run_next(deadline):
+                if deadline is not None:
+                    self.current_time = deadline
+                return predicate()
+            result = predicate()
+        return result
+
+    def wait_event(self, event, timeout=None):
+        return self.wait_for(None, event.is_set, timeout)
+
+    def call_later(self, delay, function, *args):
+        handle = VirtualEvent(function, args)
+        heapq.heappush(self.events, (self.current_time + max(delay, 0.0), next(self.order), handle))
+        return handle
+
+    def call_every(self, period, function):
+        handle = VirtualEvent(function, (), period)
+        heapq.heappush(self.events, (self.current_time + period, next(self.order), handle))
+        return handle
+
+    def run_until(self, end_time):
+        while self.run_next(end_time):
+            pass
+        self.current_time = max(self.current_time, end_time)
+
+    def run_next(self, end_time=None):
+        '''
+        Method to advance to the next event due by end_time and run it
+        :return: Boolean for if an event was run
+        '''
+        while self.events:
+            due, _, handle = self.events[0]
+            if end_time is not None and due > end_time:
+                return False
+            heapq.heappop(self.events)
+            if handle.cancelled:
+                continue
+            self.current_time = max(self.current_time, due)
+            if handle.period:
+                heapq.heappush(self.events, (due + handle.period, next(self.order), handle))
+            handle.function(*handle.args)
+            return True
+        return False
+
+
+class VirtualEvent():
+    def __init__(self, function, args, period=None):
+        self.function = function
+        self.args = args
+        self.period = period
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
@@ -1,5 +1,10 @@
 import enum
+import itertools
 import math
+import threading
+from time import time
+
+import numpy as np
 
 class Frames(enum.Enum):
     ''' 
@@ -10,7 +15,28 @@ class Frames(enum.Enum):
     VEL = 'VEL'
 
 
+class JobStatus(enum.Enum):
+    '''
+    Describes the state of an asynchronous movement command
+    '''
+    RUNNING = 'RUNNING'
+    REACHED = 'REACHED'
+    TIMEOUT = 'TIMEOUT'
+    SUPERSEDED = 'SUPERSEDED'
+    FAILED = 'FAILED'
+
+
+class Geodesy(enum.Enum):
+    '''
+    Describes the earth model a distance is calculated with, from fastest to most accurate
+    '''
+    EQUIRECTANGULAR = 'EQUIRECTANGULAR'     # flat earth about the mean latitude, for short distances (arrival checks)
+    HAVERSINE = 'HAVERSINE'                 # great circle on a sphere of radius R
+    VINCENTY = 'VINCENTY'                   # WGS-84 ellipsoid, iterative (planning)
+
+
 R = 6378137.0  # Equator radius in meters
+F = 0.00335281066474748071  # 1/298.257223563, WGS-84 flattening
 
 
 def arc_to_deg(arc):
@@ -35,6 +61,66 @@ def latlon_to_xyz(lat,lon):
     z = r * math.cos(theta)
     return [x,y,z]
 
+def equirectangular_distance(lat1, lon1, lat2, lon2):
+    '''
+    Function for the ground distance in meters between two lat/lon points on a flat earth about their mean latitude
+    '''
+    x = math.radians(lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2.0))
+    y = math.radians(lat2 - lat1)
+    return R * math.sqrt(x*x + y*y)
+
+def haversine_distance(lat1, lon1, lat2, lon2):
+    '''
+    Function for the great circle ground distance in meters between two lat/lon points
+    '''
+    phi_1 = math.radians(lat1)
+    phi_2 = math.radians(lat2)
+    a = math.sin(math.radians(lat1 - lat2)/2.0)**2 + \
+        math.cos(phi_1)*math.cos(phi_2)*math.sin(math.radians(lon1 - lon2)/2.0)**2
+    return R * 2*math.atan2(math.sqrt(a), math.sqrt(1-a))
+
+def vincenty_distance(lat1, lon1, lat2, lon2, iterations=200):
+    '''
+    Function for the ground distance in meters between two lat/lon points on the WGS-84 ellipsoid (Vincenty's
+    inverse formula). Nearly antipodal points may not converge, the last iteration is used
+    '''
+    b = (1 - F) * R
+    L = math.radians(lon2 - lon1)
+    U1 = math.atan((1 - F) * math.tan(math.radians(lat1)))
+    U2 = math.atan((1 - F) * math.tan(math.radians(lat2)))
+    sin_U1, cos_U1 = math.sin(U1), math.cos(U1)
+    sin_U2, cos_U2 = math.sin(U2), math.cos(U2)
+
+    lam = L
+    for _ in range(iterations):
+        sin_lam, cos_lam = math.sin(lam), math.cos(lam)
+        sin_sigma = math.sqrt((cos_U2*sin_lam)**2 + (cos_U1*sin_U2 - sin_U1*cos_U2*cos_lam)**2)
+        if sin_sigma == 0:
+            return 0.0      # same point
+        cos_sigma = sin_U1*sin_U2 + cos_U1*cos_U2*cos_lam
+        sigma = math.atan2(sin_sigma, cos_sigma)
+        sin_alpha = cos_U1*cos_U2*sin_lam / sin_sigma
+        cos2_alpha = 1 - sin_alpha**2
+        cos_2sigma_m = cos_sigma - 2*sin_U1*sin_U2/cos2_alpha if cos2_alpha != 0 else 0.0    # 0 on the equator
+        C = F/16*cos2_alpha*(4 + F*(4 - 3*cos2_alpha))
+        last_lam = lam
+        lam = L + (1 - C)*F*sin_alpha*(sigma + C*sin_sigma*(cos_2sigma_m + C*cos_sigma*(-1 + 2*cos_2sigma_m**2)))
+        if abs(lam - last_lam) < 1e-12:
+            break
+
+    u2 = cos2_alpha * (R*R - b*b) / (b*b)
+    A = 1 + u2/16384*(4096 + u2*(-768 + u2*(320 - 175*u2)))
+    B = u2/1024*(256 + u2*(-128 + u2*(74 - 47*u2)))
+    delta_sigma = B*sin_sigma*(cos_2sigma_m + B/4*(cos_sigma*(-1 + 2*cos_2sigma_m**2) -
+                  B/6*cos_2sigma_m*(-3 + 4*sin_sigma**2)*(-3 + 4*cos_2sigma_m**2)))
+    return b*A*(sigma - delta_sigma)
+
+GROUND_DISTANCE = {
+    Geodesy.EQUIRECTANGULAR: equirectangular_distance,
+    Geodesy.HAVERSINE: haversine_distance,
+    Geodesy.VINCENTY: vincenty_distance,
+}
+
 def xyz_to_latlon (ref, dn, de, dd):
     """
     Convert cartesian to angular lat/lon coordiantes
@@ -53,11 +139,263 @@ def xyz_to_latlon (ref, dn, de, dd):
 
     return Waypoint(x=lat, y=lon, z=alt)
 
+#######################################
+### Batch Geodesy (NumPy)
+#######################################
+
+def as_points(points):
+    '''
+    Function to read points into a float array
+    :param points: Waypoint, [lat, lon(, alt)], or N x 2 / N x 3 array-like
+    :return: numpy array of shape (2,), (3,), (N, 2) or (N, 3)
+    '''
+    if isinstance(points, Waypoint):
+        return np.array([points.lat, points.lon, points.alt], dtype=float)
+    return np.asarray(points, dtype=float)
+
+def equirectangular_distances(lat1, lon1, lat2, lon2):
+    '''
+    Function for equirectangular_distance over arrays
+    '''
+    x = np.radians(lon2 - lon1) * np.cos(np.radians((lat1 + lat2) / 2.0))
+    y = np.radians(lat2 - lat1)
+    return R * np.sqrt(x*x + y*y)
+
+def haversine_distances(lat1, lon1, lat2, lon2):
+    '''
+    Function for haversine_distance over arrays
+    '''
+    phi_1 = np.radians(lat1)
+    phi_2 = np.radians(lat2)
+    a = np.sin(np.radians(lat1 - lat2)/2.0)**2 + np.cos(phi_1)*np.cos(phi_2)*np.sin(np.radians(lon1 - lon2)/2.0)**2
+    return R * 2*np.arctan2(np.sqrt(a), np.sqrt(1-a))
+
+def vincenty_distances(lat1, lon1, lat2, lon2, iterations=200):
+    '''
+    Function for vincenty_distance over arrays, iterating until every pair has converged
+    '''
+    b = (1 - F) * R
+    L = np.radians(lon2 - lon1)
+    U1 = np.arctan((1 - F) * np.tan(np.radians(lat1)))
+    U2 = np.arctan((1 - F) * np.tan(np.radians(lat2)))
+    sin_U1, cos_U1 = np.sin(U1), np.cos(U1)
+    sin_U2, cos_U2 = np.sin(U2), np.cos(U2)
+
+    lam = L
+    for _ in range(iterations):
+        sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+        sin_sigma = np.sqrt((cos_U2*sin_lam)**2 + (cos_U1*sin_U2 - sin_U1*cos_U2*cos_lam)**2)
+        same = sin_sigma == 0
+        sin_sigma = np.where(same, 1.0, sin_sigma)      # same points are zeroed at the end
+        cos_sigma = sin_U1*sin_U2 + cos_U1*cos_U2*cos_lam
+        sigma = np.arctan2(sin_sigma, cos_sigma)
+        sin_alpha = cos_U1*cos_U2*sin_lam / sin_sigma
+        cos2_alpha = 1 - sin_alpha**2
+        equatorial = cos2_alpha == 0
+        cos_2sigma_m = np.where(equatorial, 0.0, cos_sigma - 2*sin_U1*sin_U2/np.where(equatorial, 1.0, cos2_alpha))
+        C = F/16*cos2_alpha*(4 + F*(4 - 3*cos2_alpha))
+        last_lam = lam
+        lam = L + (1 - C)*F*sin_alpha*(sigma + C*sin_sigma*(cos_2sigma_m + C*cos_sigma*(-1 + 2*cos_2sigma_m**2)))
+        if np.all(np.abs(lam - last_lam) < 1e-12):
+            break
+
+    u2 = cos2_alpha * (R*R - b*b) / (b*b)
+    A = 1 + u2/16384*(4096 + u2*(-768 + u2*(320 - 175*u2)))
+    B = u2/1024*(256 + u2*(-128 + u2*(74 - 47*u2)))
+    delta_sigma = B*sin_sigma*(cos_2sigma_m + B/4*(cos_sigma*(-1 + 2*cos_2sigma_m**2) -
+                  B/6*cos_2sigma_m*(-3 + 4*sin_sigma**2)*(-3 + 4*cos_2sigma_m**2)))
+    return np.where(same, 0.0, b*A*(sigma - delta_sigma))
+
+GROUND_DISTANCES = {
+    Geodesy.EQUIRECTANGULAR: equirectangular_distances,
+    Geodesy.HAVERSINE: haversine_distances,
+    Geodesy.VINCENTY: vincenty_distances,
+}
+
+def distances(from_points, to_points, mode=Geodesy.HAVERSINE):
+    '''
+    Function to calculate many distances at once, same models and radius as Waypoint.current_distance
+    :param from_points: Waypoint or array of [lat, lon(, alt msl)], broadcast against to_points
+    :param to_points: Waypoint or array of [lat, lon(, alt msl)]
+    :param mode: Geodesy Enum earth model for the ground distance
+    :return: numpy array of distances in meters (3D if both have altitudes, otherwise ground distance)
+    '''
+    p1 = as_points(from_points)
+    p2 = as_points(to_points)
+    ground_dist = GROUND_DISTANCES[mode](p1[..., 0], p1[..., 1], p2[..., 0], p2[..., 1])
+    if p1.shape[-1] < 3 or p2.shape[-1] < 3:
+        return ground_dist
+    return np.hypot(ground_dist, p1[..., 2] - p2[..., 2])
+
+def bearings(from_points, to_points):
+    '''
+    Function to calculate many bearings at once, same convention as Waypoint.current_bearing
+    :param from_points: Waypoint or array of [lat, lon(, alt)], broadcast against to_points
+    :param to_points: Waypoint or array of [lat, lon(, alt)]
+    :return: numpy array of bearings in radians from from_points towards to_points
+    '''
+    p1 = as_points(from_points)
+    p2 = as_points(to_points)
+    theta_1, lambda_1 = np.pi/2 - np.radians(p1[..., 0]), np.radians(p1[..., 1])
+    theta_2, lambda_2 = np.pi/2 - np.radians(p2[..., 0]), np.radians(p2[..., 1])
+    dx = 6371 * (np.sin(theta_2)*np.cos(lambda_2) - np.sin(theta_1)*np.cos(lambda_1))
+    dy = 6371 * (np.sin(theta_2)*np.sin(lambda_2) - np.sin(theta_1)*np.sin(lambda_1))
+    return 2*np.pi - np.arctan2(dy, dx) + np.pi/2
+
+def lla_to_ned(origin, points):
+    '''
+    Function to convert many lat/lon(/alt) points to offsets from an origin, same WGS-84 approximation as
+    Waypoint.LLA_2_Coords
+    :param origin: Waypoint or [lat, lon(, alt msl)] of the reference origin
+    :param points: array of [lat, lon] or [lat, lon, alt msl]
+    :return: numpy array of [dNorth, dEast] (or [dNorth, dEast, dDown] if both have altitudes) in meters
+    '''
+    o = as_points(origin)
+    p = as_points(points)
+    ff = (2.0 * F) - (F ** 2)
+    lat_o = np.radians(o[0])
+    sin_lat = np.sin(lat_o)
+    Rn = R / np.sqrt(1 - (ff * (sin_lat ** 2)))
+    Rm = Rn * ((1 - ff) / (1 - (ff * (sin_lat ** 2))))
+
+    d_north = np.radians(p[..., 0] - o[0]) / np.arctan2(1, Rm)
+    d_east = np.radians(p[..., 1] - o[1]) / np.arctan2(1, Rn * np.cos(lat_o))
+    if o.shape[-1] < 3 or p.shape[-1] < 3:
+        return np.stack([d_north, d_east], axis=-1)
+    return np.stack([d_north, d_east, o[2] - p[..., 2]], axis=-1)
+
+def ned_to_lla(origin, ned):
+    '''
+    Function to convert many offsets from an origin to lat/lon/alt, same flat earth as xyz_to_latlon
+    :param origin: Waypoint or [lat, lon, alt msl] of the reference origin
+    :param ned: array of [dNorth, dEast, dDown] in meters
+    :return: numpy array of [lat, lon, alt msl]
+    '''
+    o = as_points(origin)
+    n = as_points(ned)
+    lat = o[0] + np.degrees(n[..., 0]/R)
+    lon = o[1] + np.degrees(n[..., 1]/(R*np.cos(np.radians(o[0]))))
+    return np.stack([lat, lon, o[2] - n[..., 2]], axis=-1)
+
+#######################################
+### Local Tangent Plane
+#######################################
+
+class TangentPlane():
+    def __init__(self, origin):
+        '''
+        Conversions between lat/lon/alt and NED meters from one origin, with every origin dependent term of the
+        LLA_2_Coords WGS-84 approximation worked out once. Both directions use the same radii, so a point converted
+        there and back is unchanged.
+        :param origin: Waypoint or [lat, lon, alt msl] of the NED origin (normally BasicArdu.global_home_waypoint)
+        '''
+        self.lat, self.lon, self.alt = (float(value) for value in as_points(origin)[:3])
+
+        ff = (2.0 * F) - (F ** 2)
+        sin_lat = math.sin(math.radians(self.lat))
+        Rn = R / math.sqrt(1 - (ff * (sin_lat ** 2)))        # radius of curvature in the prime vertical
+        Rm = Rn * ((1 - ff) / (1 - (ff * (sin_lat ** 2))))   # radius of curvature in the meridian
+
+        self.deg_per_north = math.degrees(math.atan2(1, Rm))                                   # degrees lat per meter
+        self.deg_per_east = math.degrees(math.atan2(1, Rn * math.cos(math.radians(self.lat))))  # degrees lon per meter
+
+    def lla(self, north, east, down):
+        '''
+        Method to convert one NED offset to (lat, lon, alt msl)
+        '''
+        return self.lat + north*self.deg_per_north, self.lon + east*self.deg_per_east, self.alt - down
+
+    def ned(self, lat, lon, alt):
+        '''
+        Method to convert one lat/lon/alt msl to [dNorth, dEast, dDown] in meters
+        '''
+        return [(lat - self.lat)/self.deg_per_north, (lon - self.lon)/self.deg_per_east, self.alt - alt]
+
+    def waypoint(self, north, east, down, phi=0.0):
+        '''
+        Method to convert one NED offset to an LLA Waypoint
+        '''
+        lat, lon, alt = self.lla(north, east, down)
+        return Waypoint(x=lat, y=lon, z=alt, compass_angle=phi)
+
+    def ned_to_lla(self, ned):
+        '''
+        Method to convert an [dNorth, dEast, dDown] point or N x 3 array to [lat, lon, alt msl]
+        '''
+        n = as_points(ned)
+        return np.stack([self.lat + n[..., 0]*self.deg_per_north, self.lon + n[..., 1]*self.deg_per_east,
+                         self.alt - n[..., 2]], axis=-1)
+
+    def lla_to_ned(self, lla):
+        '''
+        Method to convert a Waypoint, [lat, lon, alt msl] point or N x 3 array to [dNorth, dEast, dDown]
+        '''
+        p = as_points(lla)
+        return np.stack([(p[..., 0] - self.lat)/self.deg_per_north, (p[..., 1] - self.lon)/self.deg_per_east,
+                         self.alt - p[..., 2]], axis=-1)
+
+#######################################
+### Mission Transform
+#######################################
+
+class MissionTransform():
+    def __init__(self, matrix=None):
+        '''
+        Affine transform of [dNorth, dEast] offsets in meters, kept as a 3 x 3 homogeneous matrix. rotate, scale and
+        translate return a new transform applied after this one, so a chain of them is one matrix and a whole
+        path is transformed with a single product
+        :param matrix: 3 x 3 array-like, defaults to the identity
+        '''
+        self.matrix = np.identity(3) if matrix is None else np.asarray(matrix, dtype=float)
+
+    def then(self, matrix, origin=(0.0, 0.0)):
+        '''
+        Method to add a 3 x 3 matrix after this transform, applied about origin [dNorth, dEast]
+        '''
+        shift = np.array([[1.0, 0.0, origin[0]], [0.0, 1.0, origin[1]], [0.0, 0.0, 1.0]])
+        unshift = np.array([[1.0, 0.0, -origin[0]], [0.0, 1.0, -origin[1]], [0.0, 0.0, 1.0]])
+        return MissionTransform(shift @ np.asarray(matrix, dtype=float) @ unshift @ self.matrix)
+
+    def rotate(self, angle, origin=(0.0, 0.0)):
+        '''
+        :param angle: float radians, positive turns north towards east
+        '''
+        c, s = math.cos(angle), math.sin(angle)
+        return self.then([[c, -s, 0.0], [s, c, 0.0], [0.0, 0.0, 1.0]], origin)
+
+    def scale(self, factor, origin=(0.0, 0.0)):
+        return self.then([[factor, 0.0, 0.0], [0.0, factor, 0.0], [0.0, 0.0, 1.0]], origin)
+
+    def translate(self, north, east):
+        return self.then([[1.0, 0.0, north], [0.0, 1.0, east], [0.0, 0.0, 1.0]])
+
+    def apply(self, points):
+        '''
+        Method to transform [dNorth, dEast(, dDown)] points, dDown is kept as it is
+        :param points: N x 2 or N x 3 array-like
+        :return: numpy array of the same shape
+        '''
+        points = np.array(points, dtype=float).reshape(len(points), -1)
+        points[:, :2] = points[:, :2] @ self.matrix[:2, :2].T + self.matrix[:2, 2]
+        return points
+
+    def to_lla(self, plane, points, down=0.0):
+        '''
+        Method to transform [dNorth, dEast] points and project them to lat/lon/alt
+        :param plane: TangentPlane object the offsets are from
+        :param down: float meters down (or N floats) for every point
+        :return: numpy array of [lat, lon, alt msl]
+        '''
+        ned = self.apply(points)[:, :2]
+        return plane.ned_to_lla(np.column_stack([ned, np.broadcast_to(down, len(ned))]))
+
 #######################################
 ### Waypoint Object
 #######################################
 
 class Waypoint():
+    __slots__ = ('name', 'phi', 'lat', 'lon', 'alt')
+
     def __init__(self, x=0.0, y=0.0, z=0.0, compass_angle=0.0, name=None):
         '''
         Waypoint Class
@@ -83,39 +421,20 @@ class Waypoint():
         self.lon = vehicle.location.global_frame.lon
         self.alt = vehicle.location.global_frame.alt	
     
-    def current_distance(self, vehicle, to_waypoint=None):
+    def current_distance(self, vehicle, to_waypoint=None, mode=Geodesy.HAVERSINE):
         '''
         Method to calculate the distance between waypoints. If two_waypoint is None, then distance from drone to waypoint is used
         :param vehicle: Dronekit vehicle object
         :param to_waypoint: is a Waypoint object. If inputted, vehicle is ignored
+        :param mode: Geodesy Enum earth model for the ground distance
         :return: the current distance in meters from the vehicle to the waypoint or an inputted waypoint
         '''
 
         if to_waypoint == None: # If no waypoint is specified, give distance from vehicle
-            dlat = self.lat - vehicle.location.global_frame.lat
-            dlong = self.lon - vehicle.location.global_frame.lon
-            dalt = self.alt - vehicle.location.global_frame.alt
-            phi_2=math.radians(vehicle.location.global_frame.lat)
-        else:
-            dlat = self.lat - to_waypoint.lat
-            dlong = self.lon - to_waypoint.lon
-            dalt = self.alt - to_waypoint.alt
-            phi_2=math.radians(to_waypoint.lat)
-        
-        #R=6371000                               # radius of Earth in meters
-        phi_1=math.radians(self.lat)
-        
-
-        delta_phi=math.radians(dlat)
-        delta_lambda=math.radians(dlong)
-
-        a=math.sin(delta_phi/2.0)**2+\
-            math.cos(phi_1)*math.cos(phi_2)*\
-            math.sin(delta_lambda/2.0)**2
+            to_waypoint = vehicle.location.global_frame
 
-        c=2*math.atan2(math.sqrt(a),math.sqrt(1-a))
-
-        ground_dist = R*c 
+        dalt = self.alt - to_waypoint.alt
+        ground_dist = GROUND_DISTANCE[mode](self.lat, self.lon, to_waypoint.lat, to_waypoint.lon)
 
         dist = math.sqrt((ground_dist * ground_dist) + (dalt * dalt))   # add altitude distance
         return dist                        # output distance in meters
@@ -186,3 +505,183 @@ class Waypoint():
 
     def print(self):
         print("lat : {} lon: {} alt: {} phi: {}".format(self.lat, self.lon, self.alt, self.phi))
+
+
+#######################################
+### Waypoint Array
+#######################################
+
+WAYPOINT_DTYPE = np.dtype([('lat', 'f8'), ('lon', 'f8'), ('alt', 'f8'), ('phi', 'f8'), ('name', 'i4')])
+
+class WaypointView(Waypoint):
+    __slots__ = ('owner', 'record')
+
+    def __init__(self, owner, index):
+        '''
+        Waypoint backed by one row of a WaypointArray, reads and writes go to the array
+        :param owner: WaypointArray object
+        :param index: int row in owner
+        '''
+        self.owner = owner
+        self.record = owner.data[index]
+
+    lat = property(lambda self: float(self.record['lat']), lambda self, value: self.record.__setitem__('lat', value))
+    lon = property(lambda self: float(self.record['lon']), lambda self, value: self.record.__setitem__('lon', value))
+    alt = property(lambda self: float(self.record['alt']), lambda self, value: self.record.__setitem__('alt', value))
+    phi = property(lambda self: float(self.record['phi']), lambda self, value: self.record.__setitem__('phi', value))
+
+    @property
+    def name(self):
+        index = self.record['name']
+        return None if index < 0 else self.owner.names[index]
+
+    @name.setter
+    def name(self, value):
+        self.record['name'] = self.owner.name_index(value)
+
+
+class WaypointArray():
+    def __init__(self, size=0, data=None, names=None):
+        '''
+        Collection of LLA waypoints in one structured NumPy array (lat, lon, alt msl, phi, name index). Slices
+        share memory with the array they came from, and iterating yields WaypointView objects, so it can be
+        passed anywhere a list of Waypoint objects is expected (handle_path, handle_mission)
+        :param size: int number of zeroed waypoints, if data is None
+        :param data: numpy array of WAYPOINT_DTYPE to wrap without copying
+        :param names: list of strings the name indexes refer to, shared with slices
+        '''
+        if data is None:
+            data = np.zeros(size, dtype=WAYPOINT_DTYPE)
+            data['name'] = -1
+        self.data = data
+        self.names = [] if names is None else names
+
+    @classmethod
+    def from_lla(cls, lla, phi=0.0):
+        '''
+        Method to build an array from N x 3 [lat, lon, alt msl] values
+        :param phi: float or N floats of compass angles
+        '''
+        lla = np.asarray(lla, dtype=float).reshape(-1, 3)
+        array = cls(len(lla))
+        array.data['lat'], array.data['lon'], array.data['alt'] = lla.T
+        array.data['phi'] = phi
+        return array
+
+    @classmethod
+    def from_waypoints(cls, waypoints):
+        '''
+        Method to build an array from a list of Waypoint objects
+        '''
+        array = cls(len(waypoints))
+        for index, waypoint in enumerate(waypoints):
+            array.data[index] = (waypoint.lat, waypoint.lon, waypoint.alt, waypoint.phi, array.name_index(waypoint.name))
+        return array
+
+    def name_index(self, name):
+        if name is None:
+            return -1
+        if name not in self.names:
+            self.names.append(name)
+        return self.names.index(name)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        '''
+        int index gives a WaypointView, a slice gives a WaypointArray view (an index array gives a copy)
+        '''
+        if isinstance(index, (int, np.integer)):
+            return WaypointView(self, index)
+        return WaypointArray(data=self.data[index], names=self.names)
+
+    def __iter__(self):
+        for index in range(len(self.data)):
+            yield WaypointView(self, index)
+
+    lat = property(lambda self: self.data['lat'])
+    lon = property(lambda self: self.data['lon'])
+    alt = property(lambda self: self.data['alt'])
+    phi = property(lambda self: self.data['phi'])
+
+    def lla(self):
+        '''
+        Method to get the positions as an N x 3 [lat, lon, alt msl] array (a copy)
+        '''
+        return np.stack([self.data['lat'], self.data['lon'], self.data['alt']], axis=-1)
+
+    def to_list(self):
+        '''
+        Method to copy the waypoints out as a list of Waypoint objects
+        '''
+        return [Waypoint(x=waypoint.lat, y=waypoint.lon, z=waypoint.alt, compass_angle=waypoint.phi, name=waypoint.name)
+                for waypoint in self]
+
+#######################################
+### Waypoint Job Object
+#######################################
+
+class WaypointJob():
+    _ids = itertools.count(1)
+
+    def __init__(self, target, timeout=15.0, clock=None):
+        '''
+        Handle for a waypoint command that runs in the background
+        :param target: Waypoint object the vehicle is travelling to
+        :param timeout: float seconds before the job is marked as timed out
+        :param clock: object with a time() method the job is timed on (defaults to wall clock time)
+        '''
+        self.id = next(WaypointJob._ids)
+        self.target = target
+        self.timeout = timeout
+        self.time = clock.time if clock else time
+        self.status = JobStatus.RUNNING
+        self.start_time = self.time()
+        self.end_time = None
+        self.distance_remaining = None  # meters
+        self.eta = None                 # seconds, estimated from the current groundspeed
+        self.done = threading.Event()
+
+    def update(self, distance, groundspeed):
+        '''
+        Method to update the progress of the job
+        :param distance: float meters to the target
+        :param groundspeed: float vehicle speed in m/s
+        '''
+        self.distance_remaining = distance
+        self.eta = distance / groundspeed if groundspeed and groundspeed > 0.1 else None
+
+    def finish(self, status):
+        '''
+        Method to end the job, only the first call has an effect
+        :param status: JobStatus the job finished with
+        '''
+        if self.status == JobStatus.RUNNING:
+            self.status = status
+            self.end_time = self.time()
+            if status == JobStatus.REACHED:
+                self.eta = 0.0
+            self.done.set()
+
+    def is_running(self):
+        return self.status == JobStatus.RUNNING
+
+    def wait(self, timeout=None):
+        '''
+        Method to block until the job has finished
+        :param timeout: float seconds to wait (None waits forever)
+        :return: JobStatus of the job
+        '''
+        self.done.wait(timeout)
+        return self.status
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'status': self.status.value,
+            'target': [self.target.lat, self.target.lon, self.target.alt],
+            'distance_remaining': self.distance_remaining,
+            'eta': self.eta,
+            'elapsed': (self.end_time or self.time()) - self.start_time,
+        }
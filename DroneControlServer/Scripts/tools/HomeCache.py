@@ -0,0 +1,57 @@
+import json
+import os
+
+
+class HomeCache():
+    def __init__(self, path='~/.basicardu_home_cache.json', boot_tolerance=5.0):
+        '''
+        On-disk cache of each vehicle's home location and EKF origin. Entries are keyed by MAVLink system ID and
+        only match while the autopilot has not rebooted, so a restarted script can skip fetching the home location.
+        :param path: string path of the JSON cache file
+        :param boot_tolerance: float seconds two boot time estimates may differ by and still be the same boot
+        '''
+        self.path = os.path.expanduser(path)
+        self.boot_tolerance = boot_tolerance
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
+
+    def lookup(self, system_id, boot_time):
+        '''
+        Method to find the cached entry for a vehicle
+        :param system_id: integer MAVLink system ID
+        :param boot_time: float host time (s since epoch) the autopilot booted
+        :return: dictionary with 'home' and 'origin' ([lat, lon, alt msl] or None), or None if there is no entry for this boot
+        '''
+        entry = self.load().get(str(system_id))
+        if entry is None or abs(entry['boot_time'] - boot_time) > self.boot_tolerance:
+            return None
+        return entry
+
+    def store(self, system_id, boot_time, home=None, origin=None):
+        '''
+        Method to save a vehicle's home and/or EKF origin, fields left as None keep their cached value from the same boot
+        :param system_id: integer MAVLink system ID
+        :param boot_time: float host time (s since epoch) the autopilot booted
+        :param home: [lat, lon, alt msl] or None
+        :param origin: [lat, lon, alt msl] or None
+        '''
+        entries = self.load()
+        entry = self.lookup(system_id, boot_time) or {'home': None, 'origin': None}
+        entry['boot_time'] = boot_time
+        if home is not None:
+            entry['home'] = list(home)
+        if origin is not None:
+            entry['origin'] = list(origin)
+        entries[str(system_id)] = entry
+
+        try:
+            with open(self.path + '.tmp', 'w') as file:
+                json.dump(entries, file)
+            os.replace(self.path + '.tmp', self.path)
+        except OSError as e:
+            print('WARNING: could not write home cache:', e)
@@ -1,7 +1,33 @@
 ### import libraries
+import math
 from dronekit import VehicleMode, connect, LocationGlobal, LocationLocal
 from pymavlink import mavutil
 
+# Telemetry stream profiles: MAVLink message name -> rate in Hz
+# 'mission' keeps position fresh for arrival detection, 'idle' saves link bandwidth while monitoring
+TELEMETRY_PROFILES = {
+	'mission': {
+		'GLOBAL_POSITION_INT': 20,
+		'LOCAL_POSITION_NED': 10,
+		'ATTITUDE': 10,
+		'VFR_HUD': 5,
+		'GPS_RAW_INT': 5,
+		'SYS_STATUS': 2,
+		'BATTERY_STATUS': 1,
+		'HEARTBEAT': 1,
+	},
+	'idle': {
+		'GLOBAL_POSITION_INT': 2,
+		'LOCAL_POSITION_NED': 1,
+		'ATTITUDE': 1,
+		'VFR_HUD': 1,
+		'GPS_RAW_INT': 1,
+		'SYS_STATUS': 1,
+		'BATTERY_STATUS': 0.5,
+		'HEARTBEAT': 1,
+	},
+}
+
 def waypoint_cmd_LLA(vehicle, lat, lon, alt, yaw=0):
 	'''
 	Function for adding next waypoint using global conditions
@@ -168,3 +194,113 @@ def set_home(vehicle, lat, lon, alt):
 	:param alt: float for altitude in meters msl
 	'''
 	vehicle.home_location = LocationGlobal(lat,lon, alt)
+
+
+def set_message_interval(vehicle, message_name, rate_hz):
+	'''
+	Function to request the rate of a MAVLink message stream (MAV_CMD_SET_MESSAGE_INTERVAL)
+	:param vehicle: Dronekit Vehicle class object
+	:param message_name: string MAVLink message name (ex: 'GLOBAL_POSITION_INT')
+	:param rate_hz: float messages per second (0 restores the autopilot default, negative disables the message)
+	'''
+	if rate_hz > 0:
+		interval_us = 1e6 / rate_hz
+	elif rate_hz == 0:
+		interval_us = 0		# default rate
+	else:
+		interval_us = -1	# disabled
+
+	msg = vehicle.message_factory.command_long_encode(
+		0, 0, mavutil.mavlink.MAV_CMD_SET_MESSAGE_INTERVAL, 0,
+		getattr(mavutil.mavlink, 'MAVLINK_MSG_ID_' + message_name),  # param 1: Message ID
+		interval_us,  # param 2: Interval in microseconds
+		0,  # param 3: Empty
+		0,  # param 4: Empty
+		0,  # param 5: Empty
+		0,  # param 6: Empty
+		0   # param 7: Response target (0: flight-stack default)
+	)
+	vehicle.send_mavlink(msg)
+
+def set_telemetry_profile(vehicle, profile):
+	'''
+	Function to request every message rate of a telemetry profile
+	:param vehicle: Dronekit Vehicle class object
+	:param profile: string key of TELEMETRY_PROFILES or a dictionary of message name -> rate in Hz
+	'''
+	rates = TELEMETRY_PROFILES[profile] if isinstance(profile, str) else profile
+	for message_name, rate_hz in rates.items():
+		set_message_interval(vehicle, message_name, rate_hz)
+
+
+def mission_item_int(vehicle, seq, lat, lon, alt, yaw=None, hold=0, acceptance_radius=0, command=mavutil.mavlink.MAV_CMD_NAV_WAYPOINT):
+	'''
+	Function to build (not send) a MISSION_ITEM_INT for a mission upload
+	:param vehicle: Dronekit Vehicle class object
+	:param seq: integer sequence number of the item (0 is the home location)
+	:param lat: float of latitude
+	:param lon: float of longitude
+	:param alt: float of altitude msl in meters
+	:param yaw: float of the desired yaw angle (radians) 0-2pi (0 is north , pi/2 is east), None keeps the current heading
+	:param hold: float seconds to hold at the waypoint
+	:param acceptance_radius: float meters within which the waypoint counts as reached (0 uses the autopilot WPNAV_RADIUS)
+	:param command: MAV_CMD of the item (default MAV_CMD_NAV_WAYPOINT)
+	:return: MAVLink message object
+	'''
+	return vehicle.message_factory.mission_item_int_encode(
+		0, 0,	# target system, target component
+		seq,
+		mavutil.mavlink.MAV_FRAME_GLOBAL,	# lat/lon as 1e7 integers, alt msl
+		command,
+		0,		# current
+		1,		# autocontinue
+		hold,	# param 1: Hold time (s)
+		acceptance_radius,	# param 2: Acceptance radius (m)
+		0,		# param 3: Pass radius (0 passes through the waypoint)
+		float('nan') if yaw is None else math.degrees(yaw),	# param 4: Yaw (deg), NaN keeps the current heading
+		int(lat * 1e7),
+		int(lon * 1e7),
+		alt)
+
+def mission_count(vehicle, count):
+	'''
+	Function to start a mission upload by announcing the number of items
+	:param vehicle: Dronekit Vehicle class object
+	:param count: integer number of mission items, including the home item
+	'''
+	msg = vehicle.message_factory.mission_count_encode(0, 0, count)
+	vehicle.send_mavlink(msg)
+
+def mission_set_current(vehicle, seq):
+	'''
+	Function to set the mission item the autopilot runs next
+	:param vehicle: Dronekit Vehicle class object
+	:param seq: integer sequence number of the item
+	'''
+	msg = vehicle.message_factory.mission_set_current_encode(0, 0, seq)
+	vehicle.send_mavlink(msg)
+
+def request_message(vehicle, message_name):
+	'''
+	Function to ask the autopilot to send one message (MAV_CMD_REQUEST_MESSAGE)
+	:param vehicle: Dronekit Vehicle class object
+	:param message_name: string MAVLink message name (ex: 'GPS_GLOBAL_ORIGIN')
+	'''
+	msg = vehicle.message_factory.command_long_encode(
+		0, 0, mavutil.mavlink.MAV_CMD_REQUEST_MESSAGE, 0,
+		getattr(mavutil.mavlink, 'MAVLINK_MSG_ID_' + message_name),  # param 1: Message ID
+		0, 0, 0, 0, 0, 0)
+	vehicle.send_mavlink(msg)
+
+def request_home_position(vehicle):
+	'''
+	Function to ask the autopilot for a HOME_POSITION message, instead of downloading the mission to learn the home location
+	:param vehicle: Dronekit Vehicle class object
+	'''
+	request_message(vehicle, 'HOME_POSITION')
+
+	# older firmware only answers the deprecated command
+	msg = vehicle.message_factory.command_long_encode(
+		0, 0, mavutil.mavlink.MAV_CMD_GET_HOME_POSITION, 0,
+		0, 0, 0, 0, 0, 0, 0)
+	vehicle.send_mavlink(msg)
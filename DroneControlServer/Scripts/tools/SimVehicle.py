@@ -0,0 +1,505 @@
+import heapq
+import math
+from threading import Lock
+
+from dronekit import Battery, GPSInfo, LocationGlobal, LocationGlobalRelative, LocationLocal, VehicleMode
+from pymavlink import mavutil
+
+from tools.Clock import RealClock
+from tools.CommonStructs import TangentPlane
+
+mavlink = mavutil.mavlink
+MODE_NUMBERS = {name: number for number, name in mavutil.mode_mapping_acm.items()}
+
+# ArduPilot behaviour the simulation follows
+GUIDED_VELOCITY_TIMEOUT = 3.0       # seconds a guided velocity setpoint is held without a refresh
+WAYPOINT_RADIUS = 2.0               # meters, AUTO mission items count as reached inside this radius
+
+
+class Locations():
+    '''
+    Same attributes as dronekit's vehicle.location
+    '''
+    def __init__(self):
+        self.global_frame = None
+        self.global_relative_frame = None
+        self.local_frame = None
+
+
+class SimCommands():
+    '''
+    Stands in for vehicle.commands, only the home location download is simulated
+    '''
+    def __init__(self, vehicle):
+        self.vehicle = vehicle
+
+    def download(self):
+        self.vehicle.home_location = self.vehicle.home
+
+    def wait_ready(self, timeout=None):
+        return True
+
+    @property
+    def next(self):
+        return self.vehicle.mission_seq
+
+
+class SimVehicle():
+    def __init__(self, home=(42.3398, -71.0892, 10.0), max_speed=5.0, max_climb=2.5, max_accel=2.5, land_speed=1.0,
+                 telemetry_rate=10.0, physics_rate=50.0, link_delay=0.0, system_id=1, clock=None, start=True):
+        '''
+        In-process simulated vehicle with the parts of the dronekit Vehicle interface that BasicArdu and
+        MavLowLevel use. The vehicle is a kinematic point mass flying GUIDED position/velocity targets,
+        AUTO missions, takeoff and LAND. Like dronekit, the reported location only changes when a
+        GLOBAL_POSITION_INT message arrives, at telemetry_rate (SET_MESSAGE_INTERVAL changes it).
+        :param home: (lat, lon, alt msl) of the home location, the vehicle starts on the ground there
+        :param max_speed: float m/s horizontal and overall speed limit
+        :param max_climb: float m/s vertical speed limit
+        :param max_accel: float m/s^2 acceleration limit, also used to slow down before a target
+        :param land_speed: float m/s descent rate in LAND mode
+        :param telemetry_rate: float GLOBAL_POSITION_INT messages per second
+        :param physics_rate: float simulation steps per second
+        :param link_delay: float seconds each MAVLink message takes to cross the link, in either direction
+        :param system_id: integer MAVLink system ID of the simulated autopilot
+        :param clock: RealClock or VirtualClock the simulation runs on
+        :param start: boolean, start stepping the simulation straight away
+        '''
+        self.home = LocationGlobal(*home)
+        self.plane = TangentPlane(home)
+        self.clock = clock or RealClock()
+        self.max_speed = max_speed
+        self.max_climb = max_climb
+        self.max_accel = max_accel
+        self.land_speed = land_speed
+        self.physics_period = 1.0 / physics_rate
+        self.link_delay = link_delay
+        self.message_intervals = {'GLOBAL_POSITION_INT': 1.0 / telemetry_rate, 'HEARTBEAT': 1.0, 'BATTERY_STATUS': 1.0}
+
+        self.message_factory = mavlink.MAVLink(None, srcSystem=255, srcComponent=0)            # ground station side
+        self.autopilot = mavlink.MAVLink(None, srcSystem=system_id, srcComponent=1)     # vehicle side
+
+        # dronekit attributes
+        self.location = Locations()
+        self.home_location = None           # like dronekit, only known after a download
+        self.gps_0 = GPSInfo(70, 100, 3, 12)
+        self.ekf_ok = True
+        self.battery = Battery(12600, 0, 100)     # mV, cA, % as in SYS_STATUS
+        self.system_status = 'STANDBY'
+        self.parameters = {}
+        self.commands = SimCommands(self)
+        self._mode = VehicleMode('STABILIZE')
+        self._armed = False
+
+        # simulated state (NED meters/m/s from the home location), only touched by the simulation steps
+        self.ned = [0.0, 0.0, 0.0]
+        self.ned_velocity = [0.0, 0.0, 0.0]
+        self.yaw = 0.0                      # degrees
+        self.target_position = None
+        self.target_velocity = None
+        self.velocity_time = 0.0
+        self.mission = []
+        self.mission_upload = None          # items expected in the upload in progress
+        self.mission_seq = 1
+
+        self.attribute_listeners = {}
+        self.message_listeners = {}
+        self.events = []                    # heap of (due time, order, function, args)
+        self.event_count = 0
+        self.lock = Lock()
+        self.boot_time = self.clock.time()
+        self.last_sent = {}
+        self.ticker = None
+
+        self.report_ned()
+        if start:
+            self.start()
+
+    ### dronekit interface ----------
+
+    @property
+    def mode(self):
+        return self._mode
+
+    # mode, armed and simple_takeoff send the same MAVLink messages as dronekit does for ArduPilot
+    @mode.setter
+    def mode(self, mode):
+        name = mode.name if isinstance(mode, VehicleMode) else str(mode)
+        self.send_mavlink(self.message_factory.set_mode_encode(0, mavlink.MAV_MODE_FLAG_CUSTOM_MODE_ENABLED, MODE_NUMBERS[name]))
+
+    @property
+    def armed(self):
+        return self._armed
+
+    @armed.setter
+    def armed(self, armed):
+        self.send_mavlink(self.message_factory.command_long_encode(0, 0, mavlink.MAV_CMD_COMPONENT_ARM_DISARM, 0, 1 if armed else 0, 0, 0, 0, 0, 0, 0))
+
+    @property
+    def is_armable(self):
+        return self._mode.name != 'INITIALISING' and self.gps_0.fix_type > 1 and self.ekf_ok
+
+    @property
+    def groundspeed(self):
+        return self.reported_groundspeed
+
+    @property
+    def airspeed(self):
+        return self.reported_groundspeed
+
+    @property
+    def velocity(self):
+        return self.reported_velocity
+
+    @property
+    def heading(self):
+        return int(self.reported_heading)
+
+    def add_attribute_listener(self, attr_name, observer):
+        with self.lock:
+            self.attribute_listeners.setdefault(attr_name, []).append(observer)
+
+    def remove_attribute_listener(self, attr_name, observer):
+        with self.lock:
+            if observer in self.attribute_listeners.get(attr_name, []):
+                self.attribute_listeners[attr_name].remove(observer)
+
+    def notify_attribute_listeners(self, attr_name, value):
+        for observer in list(self.attribute_listeners.get(attr_name, [])) + list(self.attribute_listeners.get('*', [])):
+            observer(self, attr_name, value)
+
+    def add_message_listener(self, name, fn):
+        with self.lock:
+            self.message_listeners.setdefault(name, []).append(fn)
+
+    def remove_message_listener(self, name, fn):
+        with self.lock:
+            if fn in self.message_listeners.get(name, []):
+                self.message_listeners[name].remove(fn)
+
+    def notify_message_listeners(self, name, msg):
+        for fn in list(self.message_listeners.get(name, [])) + list(self.message_listeners.get('*', [])):
+            fn(self, name, msg)
+
+    def send_mavlink(self, message):
+        '''
+        Method to send a message to the simulated autopilot, it is handled after link_delay
+        :param message: pymavlink message made with message_factory
+        '''
+        message.pack(self.message_factory)
+        self.schedule(self.link_delay, self.handle_message, message)
+
+    def simple_takeoff(self, alt):
+        self.send_mavlink(self.message_factory.command_long_encode(0, 0, mavlink.MAV_CMD_NAV_TAKEOFF, 0, 0, 0, 0, 0, 0, 0, float(alt)))
+
+    def wait_simple_takeoff(self, alt=None, epsilon=0.1, timeout=None):
+        self.simple_takeoff(alt)
+        start_time = self.clock.time()
+        while self.location.global_relative_frame.alt < alt - epsilon:
+            if timeout is not None and self.clock.time()-start_time > timeout:
+                raise TimeoutError('Takeoff to %s m timed out' % alt)
+            self.clock.sleep(0.05)
+
+    def simple_goto(self, location, airspeed=None, groundspeed=None):
+        alt = location.alt + self.home.alt if isinstance(location, LocationGlobalRelative) else location.alt
+        self.schedule(self.link_delay, self.goto, self.to_ned(location.lat, location.lon, alt))
+
+    def wait_ready(self, *types, **kwargs):
+        return True
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.stop()
+
+    ### simulation ----------
+
+    def start(self):
+        if self.ticker is None:
+            self.ticker = self.clock.call_every(self.physics_period, self.tick)
+
+    def stop(self):
+        if self.ticker:
+            self.ticker.cancel()
+            self.ticker = None
+
+    def tick(self):
+        self.step(self.physics_period)
+
+    def schedule(self, delay, function, *args):
+        '''
+        Method to run a function in the simulation step once delay seconds have passed
+        '''
+        with self.lock:
+            self.event_count += 1
+            heapq.heappush(self.events, (self.clock.time() + delay, self.event_count, function, args))
+
+    def step(self, dt):
+        '''
+        Method to advance the simulation by dt seconds: handle due events, move, then send due telemetry
+        '''
+        now = self.clock.time()
+        self.run_events(now)
+        self.move(now, dt)
+
+        for name, interval in self.message_intervals.items():
+            if interval > 0 and now - self.last_sent.get(name, -interval) >= interval:
+                self.last_sent[name] = now
+                self.send_telemetry(name)
+
+    def run_events(self, now):
+        while True:
+            with self.lock:
+                if not self.events or self.events[0][0] > now:
+                    break
+                _, _, function, args = heapq.heappop(self.events)
+            function(*args)
+
+    def move(self, now, dt):
+        if not self._armed:
+            self.ned_velocity = [0.0, 0.0, 0.0]
+            return
+
+        if self._mode.name == 'LAND':
+            desired = [0.0, 0.0, self.land_speed]
+        elif self._mode.name == 'AUTO' and self.mission_seq < len(self.mission):
+            target = self.to_ned(*self.mission[self.mission_seq])
+            if math.dist(target, self.ned) <= WAYPOINT_RADIUS:
+                self.mission_reached(self.mission_seq)
+            desired = self.approach_velocity(target)
+        elif self.target_velocity is not None:
+            if now - self.velocity_time > GUIDED_VELOCITY_TIMEOUT:
+                self.target_velocity = None
+                self.target_position = list(self.ned)
+            desired = self.target_velocity or [0.0, 0.0, 0.0]
+        elif self.target_position is not None:
+            desired = self.approach_velocity(self.target_position)
+        else:
+            desired = [0.0, 0.0, 0.0]
+
+        # acceleration limit
+        change = [d - v for d, v in zip(desired, self.ned_velocity)]
+        size = math.hypot(*change)
+        if size > self.max_accel * dt:
+            change = [c * self.max_accel * dt / size for c in change]
+        self.ned_velocity = [v + c for v, c in zip(self.ned_velocity, change)]
+        self.ned = [p + v * dt for p, v in zip(self.ned, self.ned_velocity)]
+
+        if self.ned[2] >= 0.0:              # on the ground
+            self.ned[2] = 0.0
+            self.ned_velocity = [0.0, 0.0, 0.0]
+            if self._mode.name == 'LAND':
+                self.set_armed(False)       # ArduPilot disarms after landing
+        if math.hypot(self.ned_velocity[0], self.ned_velocity[1]) > 0.2:
+            self.yaw = math.degrees(math.atan2(self.ned_velocity[1], self.ned_velocity[0])) % 360
+
+    def approach_velocity(self, target):
+        '''
+        Method for the velocity towards a target that can still stop on it at max_accel
+        '''
+        offset = [t - p for t, p in zip(target, self.ned)]
+        distance = math.hypot(*offset)
+        if distance < 1e-3:
+            return [0.0, 0.0, 0.0]
+        speed = min(self.max_speed, math.sqrt(2 * self.max_accel * distance))
+        desired = [o * speed / distance for o in offset]
+        if abs(desired[2]) > self.max_climb:
+            desired = [d * self.max_climb / abs(desired[2]) for d in desired]
+        return desired
+
+    ### autopilot ----------
+
+    def set_mode(self, name):
+        if name == self._mode.name:
+            return
+        self._mode = VehicleMode(name)
+        if name == 'GUIDED':
+            self.target_position = list(self.ned)       # hold where the mode changed
+            self.target_velocity = None
+        self.notify_attribute_listeners('mode', self._mode)
+        self.send_telemetry('HEARTBEAT')        # reported straight away, so a log shows the change when it happened
+
+    def set_armed(self, armed):
+        if armed == self._armed:
+            return
+        if armed and not self.is_armable:
+            return
+        if not armed and self.ned[2] < 0.0 and self._mode.name != 'LAND':
+            return                          # refuses to disarm in flight
+        self._armed = armed
+        self.system_status = 'ACTIVE' if armed else 'STANDBY'
+        if armed:
+            self.target_position = list(self.ned)
+            self.target_velocity = None
+        self.notify_attribute_listeners('armed', armed)
+        self.send_telemetry('HEARTBEAT')
+
+    def takeoff(self, alt):
+        if self._armed and self._mode.name == 'GUIDED':
+            self.target_position = [self.ned[0], self.ned[1], -alt]
+            self.target_velocity = None
+
+    def goto(self, position):
+        if self._armed and self._mode.name == 'GUIDED' and self.ned[2] < 0.0:
+            self.target_position = position
+            self.target_velocity = None
+
+    def mission_reached(self, seq):
+        self.send(self.autopilot.mission_item_reached_encode(seq))
+        if seq < len(self.mission)-1:
+            self.mission_seq = seq + 1
+            self.send(self.autopilot.mission_current_encode(self.mission_seq))
+        else:
+            self.mission_seq = len(self.mission)
+            self.target_position = list(self.ned)       # loiter at the end of the mission
+
+    def handle_message(self, msg):
+        '''
+        Method to act on a message from the ground station, as the autopilot would
+        '''
+        msg_type = msg.get_type()
+        if msg_type == 'SET_POSITION_TARGET_GLOBAL_INT':
+            self.goto(self.to_ned(msg.lat_int / 1e7, msg.lon_int / 1e7, msg.alt))
+        elif msg_type == 'SET_POSITION_TARGET_LOCAL_NED':
+            if msg.type_mask & 0b111 == 0b111:     # position ignored, velocity setpoint
+                if self._armed and self._mode.name == 'GUIDED':
+                    self.target_velocity = [msg.vx, msg.vy, msg.vz]
+                    self.velocity_time = self.clock.time()
+            else:
+                self.goto([msg.x, msg.y, msg.z])
+        elif msg_type == 'SET_MODE':
+            if msg.custom_mode in mavutil.mode_mapping_acm:
+                self.set_mode(mavutil.mode_mapping_acm[msg.custom_mode])
+        elif msg_type == 'COMMAND_LONG':
+            self.handle_command(msg)
+        elif msg_type == 'MISSION_COUNT':
+            self.mission_upload = [None] * msg.count
+            self.send(self.autopilot.mission_request_int_encode(255, 0, 0))
+        elif msg_type in ('MISSION_ITEM_INT', 'MISSION_ITEM') and self.mission_upload is not None:
+            if msg.seq < len(self.mission_upload):
+                scale = 1e7 if msg_type == 'MISSION_ITEM_INT' else 1.0
+                self.mission_upload[msg.seq] = (msg.x / scale, msg.y / scale, msg.z)      # MAV_FRAME_GLOBAL, alt msl
+            missing = [seq for seq, item in enumerate(self.mission_upload) if item is None]
+            if missing:
+                self.send(self.autopilot.mission_request_int_encode(255, 0, missing[0]))
+            else:
+                self.mission = self.mission_upload
+                self.mission_upload = None
+                self.mission_seq = 1
+                self.send(self.autopilot.mission_ack_encode(255, 0, mavlink.MAV_MISSION_ACCEPTED))
+        elif msg_type == 'MISSION_SET_CURRENT':
+            self.mission_seq = msg.seq
+            self.send(self.autopilot.mission_current_encode(msg.seq))
+
+    def handle_command(self, msg):
+        result = mavlink.MAV_RESULT_ACCEPTED
+        if msg.command == mavlink.MAV_CMD_DO_FLIGHTTERMINATION and msg.param1 > 0.5:
+            self._armed = False
+            self.ned[2] = 0.0          # falls out of the sky
+            self.ned_velocity = [0.0, 0.0, 0.0]
+            self.notify_attribute_listeners('armed', False)
+        elif msg.command == mavlink.MAV_CMD_COMPONENT_ARM_DISARM:
+            self.set_armed(msg.param1 > 0.5)
+        elif msg.command == mavlink.MAV_CMD_NAV_LAND:
+            self.set_mode('LAND')
+        elif msg.command == mavlink.MAV_CMD_NAV_TAKEOFF:
+            self.takeoff(msg.param7)
+        elif msg.command == mavlink.MAV_CMD_SET_MESSAGE_INTERVAL:
+            name = mavlink.mavlink_map[int(msg.param1)].msgname if int(msg.param1) in mavlink.mavlink_map else None
+            if name in self.message_intervals or name in ('HOME_POSITION', 'GPS_GLOBAL_ORIGIN'):
+                self.message_intervals[name] = msg.param2 / 1e6 if msg.param2 > 0 else 0.0
+        elif msg.command == mavlink.MAV_CMD_REQUEST_MESSAGE:
+            if int(msg.param1) == mavlink.MAVLINK_MSG_ID_HOME_POSITION:
+                self.send_telemetry('HOME_POSITION')
+            elif int(msg.param1) == mavlink.MAVLINK_MSG_ID_GPS_GLOBAL_ORIGIN:
+                self.send_telemetry('GPS_GLOBAL_ORIGIN')
+            else:
+                result = mavlink.MAV_RESULT_UNSUPPORTED
+        elif msg.command == mavlink.MAV_CMD_GET_HOME_POSITION:
+            self.send_telemetry('HOME_POSITION')
+        else:
+            result = mavlink.MAV_RESULT_UNSUPPORTED
+        self.send(self.autopilot.command_ack_encode(msg.command, result))
+
+    ### telemetry ----------
+
+    def send(self, msg):
+        '''
+        Method to send a message from the autopilot, listeners get it after link_delay
+        '''
+        msg.pack(self.autopilot)
+        self.schedule(self.link_delay, self.receive, msg)
+
+    def receive(self, msg):
+        '''
+        Method to deliver a message to the ground station side, updating the attributes like dronekit does
+        '''
+        msg_type = msg.get_type()
+        if msg_type == 'GLOBAL_POSITION_INT':
+            self.report_ned(msg)
+            for attr_name in ('location.global_frame', 'location.global_relative_frame', 'location.local_frame', 'location', 'velocity', 'groundspeed', 'heading'):
+                self.notify_attribute_listeners(attr_name, self.reported_value(attr_name))
+        elif msg_type == 'BATTERY_STATUS':
+            self.notify_attribute_listeners('battery', self.battery)
+        self.notify_message_listeners(msg_type, msg)
+
+    def send_telemetry(self, name):
+        lat, lon, alt = self.to_lla(self.ned)
+        if name == 'GLOBAL_POSITION_INT':
+            self.send(self.autopilot.global_position_int_encode(
+                int((self.clock.time() - self.boot_time) * 1000), int(lat * 1e7), int(lon * 1e7), int(alt * 1000),
+                int(-self.ned[2] * 1000), int(self.ned_velocity[0] * 100), int(self.ned_velocity[1] * 100),
+                int(self.ned_velocity[2] * 100), int(self.yaw * 100)))
+        elif name == 'HEARTBEAT':
+            self.send(self.autopilot.heartbeat_encode(
+                mavlink.MAV_TYPE_QUADROTOR, mavlink.MAV_AUTOPILOT_ARDUPILOTMEGA,
+                mavlink.MAV_MODE_FLAG_CUSTOM_MODE_ENABLED | (mavlink.MAV_MODE_FLAG_SAFETY_ARMED if self._armed else 0),
+                MODE_NUMBERS.get(self._mode.name, 0),
+                mavlink.MAV_STATE_ACTIVE if self._armed else mavlink.MAV_STATE_STANDBY))
+        elif name == 'BATTERY_STATUS':
+            self.send(self.autopilot.battery_status_encode(
+                0, 0, 0, 32767, [int(self.battery.voltage * 1000)] + [65535] * 9, -1, -1, -1, self.battery.level))
+        elif name == 'HOME_POSITION':
+            self.send(self.autopilot.home_position_encode(
+                int(self.home.lat * 1e7), int(self.home.lon * 1e7), int(self.home.alt * 1000), 0, 0, 0, [1, 0, 0, 0], 0, 0, 0))
+        elif name == 'GPS_GLOBAL_ORIGIN':
+            self.send(self.autopilot.gps_global_origin_encode(int(self.home.lat * 1e7), int(self.home.lon * 1e7), int(self.home.alt * 1000)))
+
+    def report_ned(self, msg=None):
+        '''
+        Method to update the reported location, from a GLOBAL_POSITION_INT message or from the state if None
+        '''
+        if msg is None:
+            lat, lon, alt = self.to_lla(self.ned)
+            velocity = list(self.ned_velocity)
+            self.reported_heading = self.yaw
+        else:
+            lat, lon, alt = msg.lat / 1e7, msg.lon / 1e7, msg.alt / 1000.0
+            velocity = [msg.vx / 100.0, msg.vy / 100.0, msg.vz / 100.0]
+            self.reported_heading = msg.hdg / 100.0
+        self.location.global_frame = LocationGlobal(lat, lon, alt)
+        self.location.global_relative_frame = LocationGlobalRelative(lat, lon, alt - self.home.alt)
+        north, east, down = self.to_ned(lat, lon, alt)
+        self.location.local_frame = LocationLocal(north, east, down)
+        self.reported_velocity = velocity
+        self.reported_groundspeed = math.hypot(velocity[0], velocity[1])
+
+    def reported_value(self, attr_name):
+        if attr_name == 'location':
+            return self.location
+        if attr_name == 'velocity':
+            return self.reported_velocity
+        if attr_name == 'groundspeed':
+            return self.reported_groundspeed
+        if attr_name == 'heading':
+            return self.heading
+        return getattr(self.location, attr_name.split('.')[1])
+
+    def to_lla(self, position):
+        '''
+        Method to convert NED meters from home to (lat, lon, alt msl), the same projection as BasicArdu
+        '''
+        return self.plane.lla(*position)
+
+    def to_ned(self, lat, lon, alt):
+        return self.plane.ned(lat, lon, alt)
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+
+'''
+MAVLink telemetry log (.tlog) recording and replay.
+
+Logs use the standard tlog format that Mission Planner, QGroundControl and the pymavlink tools read: each
+record is a big endian 64 bit host time in microseconds followed by the packed MAVLink packet. Outbound
+messages are told apart from inbound ones by their source system, the ground station's.
+
+python3 -m tools.Tlog flight.tlog       (from the Scripts directory) prints a summary of a log
+'''
+from argparse import ArgumentParser
+from collections import Counter
+from threading import Lock
+import struct
+
+from dronekit import GPSInfo, Battery, VehicleMode
+from pymavlink import mavutil
+
+from tools.Clock import RealClock
+from tools.SimVehicle import SimVehicle
+
+RECORD_HEADER = struct.Struct('>Q')
+INBOUND = 0             # autopilot -> ground station
+OUTBOUND = 1            # ground station -> autopilot
+GCS_SYSTEM_ID = 255     # dronekit's default source system
+
+
+class TlogRecorder():
+    def __init__(self, vehicle, path, clock=None):
+        '''
+        Records every message received from and sent to a vehicle. Inbound messages come from a '*' message
+        listener. Outbound ones are taken where the connection writes packed messages (vehicle._master.mav.file),
+        so mode, arming and takeoff commands are logged as well as send_mavlink. Vehicles without a MAVLink
+        connection (SimVehicle) only have their send_mavlink messages logged
+        :param vehicle: dronekit vehicle object (or SimVehicle)
+        :param path: string path of the log file, overwritten
+        :param clock: RealClock or VirtualClock the records are timestamped with
+        '''
+        self.vehicle = vehicle
+        self.path = path
+        self.clock = clock or RealClock()
+        self.file = open(path, 'wb')
+        self.lock = Lock()
+        self.records = 0
+        self.packer = mavutil.mavlink.MAVLink(None, srcSystem=GCS_SYSTEM_ID, srcComponent=0)    # for messages the vehicle did not pack
+
+        self.mav = getattr(getattr(vehicle, '_master', None), 'mav', None)
+        if self.mav is not None:
+            self.writer = self.mav.file
+            self.mav.file = self
+        else:
+            self.send_mavlink = vehicle.send_mavlink
+            vehicle.send_mavlink = self.send_callback
+        vehicle.add_message_listener('*', self.message_callback)
+
+    def close(self):
+        '''
+        Method to stop recording and close the log file
+        '''
+        if self.file is None:
+            return
+        self.vehicle.remove_message_listener('*', self.message_callback)
+        if self.mav is not None:
+            self.mav.file = self.writer
+        else:
+            self.vehicle.send_mavlink = self.send_mavlink
+        with self.lock:
+            self.file.close()
+            self.file = None
+
+    def message_callback(self, vehicle, name, msg):
+        '''
+        dronekit listener for every received message
+        '''
+        self.record(msg.get_msgbuf())
+
+    def write(self, data):
+        '''
+        Stands in for the file the connection's MAVLink object writes packed messages to, passes them on and
+        records them
+        '''
+        self.writer.write(data)
+        self.record(data)
+
+    def read(self, *args, **kwargs):
+        return self.writer.read(*args, **kwargs)
+
+    def send_callback(self, message):
+        '''
+        Replaces vehicle.send_mavlink, sends the message then records the bytes that went out
+        '''
+        self.send_mavlink(message)
+        data = message.get_msgbuf()
+        if not data:
+            data = message.pack(self.packer)
+        self.record(data)
+
+    def record(self, data):
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write(RECORD_HEADER.pack(int(self.clock.time() * 1e6)))
+            self.file.write(data)
+            self.records += 1
+
+
+def read_tlog(path, gcs_system=GCS_SYSTEM_ID):
+    '''
+    Generator over the records of a log
+    :param path: string path of the log file
+    :param gcs_system: int source system of the ground station, its messages are OUTBOUND
+    :return: yields (time in seconds, direction, MAVLink message) in file order, undecodable packets are skipped
+    '''
+    log = mavutil.mavlink_connection(path, notimestamps=False)
+    try:
+        while True:
+            msg = log.recv_msg()
+            if msg is None:
+                return
+            if msg.get_type() == 'BAD_DATA':
+                continue
+            yield msg._timestamp, OUTBOUND if msg.get_srcSystem() == gcs_system else INBOUND, msg
+    finally:
+        log.close()
+
+
+class ReplayVehicle(SimVehicle):
+    def __init__(self, path, speed=1.0, physics_rate=100.0, sync_timeout=1.0, clock=None, start=False):
+        '''
+        Plays the inbound side of a log back through the SimVehicle listener interface, so BasicArdu and its
+        callbacks see the recorded flight. Commands sent to it are kept in sent_messages but do not change
+        the replay, except that the replay pauses before a received message until as many messages have
+        been sent as had been when it was recorded, so replies never arrive before their requests.
+        :param path: string path of the log file
+        :param speed: float replay speed, 1.0 is real time (a VirtualClock replays as fast as possible)
+        :param physics_rate: float times per second due records are delivered
+        :param sync_timeout: float seconds the replay pauses for a command that is not sent before going on
+        :param clock: RealClock or VirtualClock the replay runs on
+        :param start: boolean, start the replay straight away. Otherwise it starts with the first message sent
+                      to the vehicle (BasicArdu sends one on connect), so no recorded message is missed
+        '''
+        self.records = []       # (seconds from the first record, messages sent before it, message)
+        first_time = None
+        outbound = 0
+        for record_time, direction, msg in read_tlog(path):
+            first_time = record_time if first_time is None else first_time
+            if direction == OUTBOUND:
+                outbound += 1
+            else:
+                self.records.append((record_time - first_time, outbound, msg))
+        if not self.records:
+            raise ValueError('no inbound messages in %s' % path)
+        self.speed = speed
+        self.sync_timeout = sync_timeout
+        self.next_record = 0
+        self.replay_time = 0.0          # log time reached
+        self.last_step = None
+        self.wait_start = None          # clock time the replay paused for a command
+        self.outbound = 0               # messages sent to the replay
+        self.outbound_missing = 0       # recorded messages given up on after sync_timeout
+        self.sent_messages = []
+
+        home = (0.0, 0.0, 0.0)
+        for _, _, msg in self.records:
+            if msg.get_type() in ('HOME_POSITION', 'GLOBAL_POSITION_INT'):
+                lat, lon = (msg.latitude, msg.longitude) if msg.get_type() == 'HOME_POSITION' else (msg.lat, msg.lon)
+                home = (lat / 1e7, lon / 1e7, (msg.altitude if msg.get_type() == 'HOME_POSITION' else msg.alt) / 1000.0)
+                break
+
+        SimVehicle.__init__(self, home=home, physics_rate=physics_rate, clock=clock, start=False)
+        self._mode = VehicleMode('INITIALISING')
+        # dronekit's connect returns after the first heartbeat, so the replay starts in the state it reported
+        for _, _, msg in self.records:
+            if msg.get_type() == 'HEARTBEAT' and msg.type != mavutil.mavlink.MAV_TYPE_GCS:
+                self._mode = VehicleMode(mavutil.mode_string_v10(msg))
+                self._armed = bool(msg.base_mode & mavutil.mavlink.MAV_MODE_FLAG_SAFETY_ARMED)
+                break
+        if start:
+            self.start()
+
+    def send_mavlink(self, message):
+        self.outbound += 1
+        SimVehicle.send_mavlink(self, message)
+        self.start()
+
+    def finished(self):
+        return self.next_record >= len(self.records)
+
+    def step(self, dt):
+        '''
+        Method to deliver every record that is due at the replay speed
+        '''
+        now = self.clock.time()
+        self.run_events(now)
+        if self.last_step is not None:
+            self.replay_time += (now - self.last_step) * self.speed
+        self.last_step = now
+
+        while self.next_record < len(self.records):
+            record_time, outbound, msg = self.records[self.next_record]
+            if record_time > self.replay_time:
+                break
+            if self.outbound + self.outbound_missing < outbound:
+                self.wait_start = now if self.wait_start is None else self.wait_start
+                if now - self.wait_start < self.sync_timeout:
+                    self.replay_time = record_time      # paused until the command this message followed is sent
+                    break
+                self.outbound_missing = outbound - self.outbound
+            self.wait_start = None
+            self.next_record += 1
+            self.receive(msg)
+
+    def receive(self, msg):
+        '''
+        Method to deliver a recorded message, updating the attributes that SimVehicle would have simulated
+        '''
+        msg_type = msg.get_type()
+        if msg_type == 'HEARTBEAT' and msg.type != mavutil.mavlink.MAV_TYPE_GCS:
+            mode = VehicleMode(mavutil.mode_string_v10(msg))
+            armed = bool(msg.base_mode & mavutil.mavlink.MAV_MODE_FLAG_SAFETY_ARMED)
+            if mode.name != self._mode.name:
+                self._mode = mode
+                self.notify_attribute_listeners('mode', mode)
+            if armed != self._armed:
+                self._armed = armed
+                self.notify_attribute_listeners('armed', armed)
+        elif msg_type == 'GPS_RAW_INT':
+            self.gps_0 = GPSInfo(msg.eph, msg.epv, msg.fix_type, msg.satellites_visible)
+            self.notify_attribute_listeners('gps_0', self.gps_0)
+        elif msg_type == 'SYS_STATUS':
+            self.battery = Battery(msg.voltage_battery, msg.current_battery, msg.battery_remaining)
+            self.notify_attribute_listeners('battery', self.battery)
+        SimVehicle.receive(self, msg)
+
+    def handle_message(self, msg):
+        self.sent_messages.append((self.clock.time(), msg))
+
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('path', type=str, help='tlog file, from TlogRecorder or any ground station')
+    options = parser.parse_args()
+
+    counts = Counter()
+    first_time = last_time = None
+    for record_time, direction, msg in read_tlog(options.path):
+        counts[('in' if direction == INBOUND else 'out', msg.get_type())] += 1
+        first_time = record_time if first_time is None else first_time
+        last_time = record_time
+
+    if first_time is None:
+        print('No records in', options.path)
+        return
+    print('%d records over %.1f s' % (sum(counts.values()), last_time - first_time))
+    for (direction, msg_type), count in sorted(counts.items()):
+        print('  %-3s %-32s %6d' % (direction, msg_type, count))
+
+
+if __name__ == '__main__':
+    main()
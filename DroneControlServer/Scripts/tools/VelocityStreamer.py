@@ -0,0 +1,101 @@
+import math
+from threading import Lock
+
+from tools.Clock import RealClock
+from tools.MavLowLevel import velocity_cmd_NED
+
+
+class VelocityStreamer():
+    def __init__(self, vehicle, rate_hz=20.0, watchdog_timeout=1.0, clock=None):
+        '''
+        Thread that re-sends the current velocity setpoint at a fixed rate. ArduPilot stops a velocity
+        command after ~3 s without a refresh, so the setpoint is held here instead of by the caller.
+        :param vehicle: dronekit vehicle object
+        :param rate_hz: float setpoint messages per second (10-50 Hz is typical)
+        :param watchdog_timeout: float seconds without set_velocity before the setpoint is zeroed
+        :param clock: RealClock or VirtualClock the setpoints are sent on
+        '''
+        self.vehicle = vehicle
+        self.clock = clock or RealClock()
+        self.period = 1.0 / rate_hz
+        self.watchdog_timeout = watchdog_timeout
+
+        self.lock = Lock()
+        self.setpoint = (0.0, 0.0, 0.0, 0.0)    # vNorth, vEast, vDown (m/s), yaw (rad)
+        self.last_update = self.clock.time()
+        self.last_send = None
+        self.ticker = None
+
+        # send timing statistics
+        self.sent = 0
+        self.watchdog_trips = 0
+        self.mean_interval = 0.0
+        self.m2_interval = 0.0              # running sum of squared deviations (Welford)
+        self.max_jitter = 0.0               # largest |interval - period|
+
+    def start(self):
+        if self.ticker:
+            return
+        self.last_update = self.clock.time()
+        self.last_send = None
+        self.ticker = self.clock.call_every(self.period, self.send)
+
+    def stop(self, zero=True):
+        '''
+        Method to stop streaming
+        :param zero: boolean, send one zero velocity setpoint so the vehicle stops
+        '''
+        if self.ticker:
+            self.ticker.cancel()
+            self.ticker = None
+        if zero:
+            self.set_velocity(0.0, 0.0, 0.0)
+            velocity_cmd_NED(self.vehicle, 0.0, 0.0, 0.0, 0.0)
+
+    def set_velocity(self, vNorth, vEast, vDown, yaw=0.0):
+        '''
+        Method to update the setpoint, also feeds the watchdog
+        '''
+        with self.lock:
+            self.setpoint = (vNorth, vEast, vDown, yaw)
+            self.last_update = self.clock.time()
+
+    def send(self):
+        '''
+        Method to send the current setpoint, run every period by the clock
+        '''
+        now = self.clock.time()
+        with self.lock:
+            if now - self.last_update > self.watchdog_timeout and self.setpoint[:3] != (0.0, 0.0, 0.0):
+                print('WARNING: VELOCITY SETPOINT STALE, STOPPING')
+                self.setpoint = (0.0, 0.0, 0.0, self.setpoint[3])
+                self.watchdog_trips += 1
+            setpoint = self.setpoint
+
+        velocity_cmd_NED(self.vehicle, *setpoint)
+        self.sent += 1
+        if self.last_send is not None:
+            self.record_interval(now - self.last_send)
+        self.last_send = now
+
+    def record_interval(self, interval):
+        count = self.sent       # number of intervals including this one
+        delta = interval - self.mean_interval
+        self.mean_interval += delta / count
+        self.m2_interval += delta * (interval - self.mean_interval)
+        self.max_jitter = max(self.max_jitter, abs(interval - self.period))
+
+    def stats(self):
+        '''
+        Method to report the send timing
+        :return: dictionary with messages sent, mean interval, interval std deviation and max jitter (seconds), watchdog trips
+        '''
+        intervals = max(self.sent - 1, 0)
+        return {
+            'sent': self.sent,
+            'rate_hz': 1.0 / self.period,
+            'mean_interval': self.mean_interval,
+            'jitter_std': math.sqrt(self.m2_interval / intervals) if intervals > 1 else 0.0,
+            'max_jitter': self.max_jitter,
+            'watchdog_trips': self.watchdog_trips,
+        }
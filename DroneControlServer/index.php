@@ -2,52 +2,40 @@
 <html lang="en">
 
 <?php
-  
-  if ( isset($_GET['command']) ) {
-    if($_GET['command']=='arm'){
-      exec('python3 Scripts/BasicArdu/arming.py');
-    }
-
-    if($_GET['command']=='disarm'){
-      exec('python3 Scripts/BasicArdu/disarming.py');
-    }
-
-    if($_GET['command']=='takeoff'){
-      exec('python3 Scripts/BasicArdu/takeoff.py');
-    }
-
-    if($_GET['command']=='landing'){
-      exec('python3 Scripts/BasicArdu/landing.py');
-    }
-
-    if($_GET['command']=='square'){
-      exec('python3 Scripts/BasicArdu/squareMovement.py');
-    }
-
-    if($_GET['command']=='vertical'){
-      exec('python3 Scripts/BasicArdu/vertMovement.py');
-    }
 
-    if($_GET['command']=='left'){
-      exec('python3 Scripts/BasicArdu/moveLeft.py');
-    }
-
-    if($_GET['command']=='right'){
-      exec('python3 Scripts/BasicArdu/moveRight.py');
-    }
-
-    if($_GET['command']=='front'){
-      exec('python3 Scripts/BasicArdu/moveFront.py');
-    }
-
-    if($_GET['command']=='back'){
-      exec('python3 Scripts/BasicArdu/moveBack.py');
+  // Commands are forwarded to the persistent drone daemon (Scripts/BasicArdu/DroneDaemon.py),
+  // which keeps the vehicle connection open between clicks.
+  $daemon_host = '127.0.0.1';
+  $daemon_port = 8765;
+
+  // page command => daemon command
+  $daemon_commands = array(
+    'arm' => 'arm',
+    'disarm' => 'disarm',
+    'takeoff' => 'takeoff',
+    'landing' => 'land',
+    'square' => 'square',
+    'vertical' => 'vertical',
+    'left' => 'left',
+    'right' => 'right',
+    'front' => 'front',
+    'back' => 'back',
+    'waypoint' => 'waypoint_test',
+  );
+
+  function send_daemon_command($host, $port, $command) {
+    $sock = @fsockopen($host, $port, $errno, $errstr, 2);
+    if (!$sock) {
+      return array('success' => false, 'error' => "drone daemon not reachable: $errstr");
     }
+    fwrite($sock, json_encode(array('command' => $command)) . "\n");
+    $reply = fgets($sock);
+    fclose($sock);
+    return json_decode($reply, true);
+  }
 
-    if($_GET['command']=='waypoint'){
-      exec('python3 Scripts/BasicArdu/waypointTesting.py');
-    }
-    
+  if ( isset($_GET['command']) && isset($daemon_commands[$_GET['command']]) ) {
+    $reply = send_daemon_command($daemon_host, $daemon_port, $daemon_commands[$_GET['command']]);
   }
 ?>
 
@@ -79,6 +67,31 @@
   <button class="button" onclick="location.href = 'index.php?command=disarm'">Disarming</button>
   </div>
 
+  <div class="telemetry">
+    <p>Position: <span id="telemetry-position">-</span></p>
+    <p>Mode: <span id="telemetry-mode">-</span> | Armed: <span id="telemetry-armed">-</span> | Battery: <span id="telemetry-battery">-</span></p>
+  </div>
+
+  <script>
+    // Live state pushed by server.py; every open page shares the server's single vehicle listener
+    var telemetry = new EventSource('http://' + window.location.hostname + ':8080/stream');
+    telemetry.onmessage = function (event) {
+      var state = JSON.parse(event.data);
+      if (state.lat !== null) {
+        document.getElementById('telemetry-position').textContent = state.lat.toFixed(7) + ', ' + state.lon.toFixed(7) + ', ' + state.alt.toFixed(1) + ' m';
+      }
+      document.getElementById('telemetry-mode').textContent = state.mode;
+      document.getElementById('telemetry-armed').textContent = state.armed;
+      if (state.battery_voltage !== null) {
+        document.getElementById('telemetry-battery').textContent = state.battery_voltage.toFixed(2) + ' V';
+      }
+    };
+  </script>
+
+  <?php if ( isset($reply) && !$reply['success'] ) { ?>
+  <p class="commanderror"><?php echo htmlspecialchars($reply['error']); ?></p>
+  <?php } ?>
+
   <br>
 
   <div class="movementheading">
@@ -1,23 +1,210 @@
-from http.server import BaseHTTPRequestHandler, HTTPServer
-import time
+#!/usr/bin/env python3
+
+'''
+HTTP control and telemetry API for the drones. Every request runs on its own thread
+(HTTP/1.1 keep-alive), so a long waypoint command only holds its own vehicle's command
+lock while /state and the other vehicles keep answering.
+
+GET  /vehicles                          names of the connected vehicles
+GET  /state?vehicle=drone1              position, mode, armed state and battery
+GET  /stream?vehicle=drone1             Server-Sent Events telemetry (all vehicles if none given)
+POST /arm /disarm /guided /land /hold /kill
+POST /takeoff        {"alt": 5}
+POST /telemetry      {"profile": "idle"}  telemetry message rates (mission or idle)
+POST /waypoint       {"frame": "NED", "x": 5, "y": 0, "z": -5, "phi": 0}
+                     add "wait": false to return a job straight away instead of blocking
+GET  /job?id=3                          progress of a non-blocking waypoint (current job if no id)
+POST /mission        {"frame": "NED", "waypoints": [[5, 0, -5], [5, 5, -5]]}  flown in AUTO mode
+POST /velocity       {"vn": 1, "ve": 0, "vd": 0, "yaw": 0}  streamed setpoint, resend at least once a second
+POST /velocity_stop  stop streaming and zero the velocity
+POST /path           {"frame": "NED", "waypoints": [...], "lookahead": 5}  guided, without stopping at corners
+POST /routine/<name> named movement routine (square, left, ...), {"mission": true} flies it in AUTO mode,
+                     {"path": true} blends through the corners
+
+Arguments may be passed as a JSON body or as query parameters.
+'''
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from urllib.parse import urlparse, parse_qsl
+import json
+import queue
+
+# Necessary For Package imports
+import sys
+import os
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), 'Scripts', 'BasicArdu'))
+
+from DroneDaemon import DroneDaemon, DaemonServer, ROUTINES
 
 hostName = "localhost"
 serverPort = 8080
+streamKeepalive = 15.0      # seconds between SSE keep-alive comments when there is no telemetry
+
+# HTTP route => daemon command
+ROUTES = {
+    '/arm': 'arm',
+    '/disarm': 'disarm',
+    '/guided': 'guided',
+    '/takeoff': 'takeoff',
+    '/land': 'land',
+    '/waypoint': 'goto',
+    '/hold': 'hold',
+    '/kill': 'kill',
+    '/state': 'state',
+    '/job': 'job',
+    '/telemetry': 'telemetry',
+    '/mission': 'mission',
+    '/path': 'path',
+    '/velocity': 'velocity',
+    '/velocity_stop': 'velocity_stop',
+}
+
+# commands that may be sent with GET
+READ_ONLY_COMMANDS = ('state', 'job')
+
+
+class ControlServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, drone_daemon):
+        ThreadingHTTPServer.__init__(self, address, ControlRequestHandler)
+        self.drone_daemon = drone_daemon
+
+
+class ControlRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'       # keep-alive, every response carries a Content-Length
 
-class MyServer(BaseHTTPRequestHandler):
     def do_GET(self):
+        self.handle_api(read_only=True)
+
+    def do_POST(self):
+        self.handle_api(read_only=False)
+
+    def handle_api(self, read_only):
+        url = urlparse(self.path)
+        args = dict(parse_qsl(url.query))
+        try:
+            args.update(self.read_body())
+        except ValueError as e:
+            self.send_json(400, {'success': False, 'error': 'bad request body: %s' % e})
+            return
+
+        vehicle = args.pop('vehicle', None)
+        drone_daemon = self.server.drone_daemon
+
+        if url.path == '/vehicles':
+            self.send_json(200, {'success': True, 'result': list(drone_daemon.drones)})
+            return
+
+        if url.path == '/stream':
+            self.handle_stream(vehicle)
+            return
+
+        if url.path.startswith('/routine/') and url.path[len('/routine/'):] in ROUTINES:
+            command = url.path[len('/routine/'):]
+        elif url.path in ROUTES:
+            command = ROUTES[url.path]
+        else:
+            self.send_json(404, {'success': False, 'error': 'unknown route: %s' % url.path})
+            return
+
+        if read_only and command not in READ_ONLY_COMMANDS:
+            self.send_json(405, {'success': False, 'error': 'use POST for %s' % url.path})
+            return
+
+        reply = drone_daemon.handle_command({'command': command, 'args': args, 'vehicle': vehicle})
+        self.send_json(200 if reply['success'] else 400, reply)
+
+    def handle_stream(self, vehicle):
+        '''
+        Method to stream telemetry updates as Server-Sent Events until the client disconnects
+        :param vehicle: string vehicle name, or None for every vehicle
+        '''
+        drone_daemon = self.server.drone_daemon
+        if vehicle is None:
+            hubs = list(drone_daemon.telemetry.values())
+        elif vehicle in drone_daemon.telemetry:
+            hubs = [drone_daemon.telemetry[vehicle]]
+        else:
+            self.send_json(404, {'success': False, 'error': 'unknown vehicle: %s' % vehicle})
+            return
+
+        self.close_connection = True        # the stream has no length, so it ends the connection
         self.send_response(200)
-        self.send_header("Content-type", "text/html")
+        self.send_header("Content-type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+
+        subscriber = queue.Queue(maxsize=100)
+        for hub in hubs:
+            hub.subscribe(subscriber)
+        try:
+            while True:
+                try:
+                    update = subscriber.get(timeout=streamKeepalive)
+                    self.wfile.write(('data: %s\n\n' % json.dumps(update)).encode('utf-8'))
+                except queue.Empty:
+                    self.wfile.write(b': keep-alive\n\n')
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            for hub in hubs:
+                hub.unsubscribe(subscriber)
+
+    def read_body(self):
+        '''
+        Method to read a JSON object body, if the request has one
+        :return: dictionary of arguments
+        '''
+        length = int(self.headers.get('Content-Length') or 0)
+        if length == 0:
+            return {}
+        body = json.loads(self.rfile.read(length).decode('utf-8'))
+        if not isinstance(body, dict):
+            raise ValueError('expected a JSON object')
+        return body
+
+    def send_json(self, status, payload):
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Access-Control-Allow-Origin", "*")
         self.end_headers()
-        self.wfile.write(bytes("<html><head><title>https://pythonbasics.org</title></head>", "utf-8"))
-        self.wfile.write(bytes("<p>Request: %s</p>" % self.path, "utf-8"))
-        self.wfile.write(bytes("<body>", "utf-8"))
-        self.wfile.write(bytes("<p>This is an example web server.</p>", "utf-8"))
-        self.wfile.write(bytes("</body></html>", "utf-8"))
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        if self.server.drone_daemon.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser()
+    parser.add_argument('--vehicle', action='append', default=None, help='name=connection_string, may be repeated (default drone1=tcp:127.0.0.1:5762)')
+    parser.add_argument('--host', type=str, default=hostName, help='address to listen on')
+    parser.add_argument('--port', type=int, default=serverPort, help='HTTP port to listen on')
+    parser.add_argument('--daemon_port', type=int, default=None, help='also serve the DroneDaemon socket protocol (used by index.php) on this port')
+    parser.add_argument('--verbose', action='store_true', help='extra text outputs')
+    options = parser.parse_args()
+
+    vehicles = {}
+    for entry in options.vehicle or ['drone1=tcp:127.0.0.1:5762']:
+        name, connection_string = entry.split('=', 1)
+        vehicles[name] = connection_string
+
+    drone_daemon = DroneDaemon(vehicles, verbose=options.verbose)
+
+    socket_server = None
+    if options.daemon_port:
+        socket_server = DaemonServer((options.host, options.daemon_port), drone_daemon)
+        Thread(target=socket_server.serve_forever, daemon=True).start()
+        print("Drone daemon listening on %s:%s" % (options.host, options.daemon_port))
 
-if __name__ == "__main__":        
-    webServer = HTTPServer((hostName, serverPort), MyServer)
-    print("Server started http://%s:%s" % (hostName, serverPort))
+    webServer = ControlServer((options.host, options.port), drone_daemon)
+    print("Server started http://%s:%s" % (options.host, options.port))
 
     try:
         webServer.serve_forever()
@@ -25,4 +212,8 @@ if __name__ == "__main__":
         pass
 
     webServer.server_close()
+    if socket_server:
+        socket_server.shutdown()
+        socket_server.server_close()
+    drone_daemon.close()
     print("Server stopped.")